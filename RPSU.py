@@ -1,275 +1,2748 @@
 import os
-import telnetlib
 import re
 import time
+import asyncio
 import csv
-import tkinter as tk
-from tkinter import messagebox, scrolledtext, ttk
 from datetime import datetime, timedelta
 import threading
-import pystray
-from PIL import Image, ImageDraw
 import sys
+import argparse
+import signal
+import atexit
+import queue
+import sqlite3
+import gzip
+import shutil
 import json
+import bisect
+import heapq
+import itertools
+import random
+import multiprocessing
+import hashlib
+import zlib
+from array import array
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Глобальные переменные
 devices = []
-MAX_DEVICES = 5
+MAX_DEVICES = None  # без ограничения
+MAX_CONCURRENT_POLLS = 50  # одновременных Telnet-сессий
+MAX_IDLE_SESSIONS = 100    # открытых сессий в режиме удержания соединения
+keep_alive_sessions = False  # не разрывать соединение между циклами опроса
+POLL_JITTER = 0.1          # разброс срока опроса, доля интервала
+START_SPREAD = 10          # окно первого опроса новых устройств, сек
+GUI_TICK_MS = 250          # период применения результатов опроса к окну, мс
+adaptive_polling = False   # чаще опрашивать аварийные устройства, реже — стабильные
+deadband_recording = False # не писать повторяющиеся значения, только изменения и «пульс»
+capture_transcripts = False  # сохранять сырые ответы STATUS/ECHO/SHOW (<name>_raw_<ГГГГ-ММ>.jsonl.gz)
+HOT_TEMPERATURE = 40.0     # °C, выше — оранжевая строка и учащённый опрос
+FAST_POLL_INTERVAL = 60    # интервал опроса при аварии, перегреве или быстром изменении, сек
+MAX_BACKOFF = 4            # во сколько раз реже опрашивать устройство со стабильными значениями
+STABLE_POLLS = 3           # стабильных опросов подряд до очередного удвоения интервала
+HEARTBEAT_INTERVAL = 3600  # при записи по изменению — строка не реже раза в столько секунд
+PROBE_TIMEOUT = 1.0        # таймаут проверки TCP-порта, сек
+PROBE_CONCURRENCY = 500    # одновременных проверок портов
+BREAKER_FAILURES = 3       # неудачных опросов подряд, после которых устройство считается недоступным
+BREAKER_BACKOFF = 30       # первая пауза до проверки недоступного устройства, сек (дальше удваивается)
+BREAKER_MAX_BACKOFF = 900
+SHARD_RESTART_DELAY = 1    # пауза перед перезапуском упавшего процесса-шарда, сек (растёт при повторах)
+SHARD_MAX_RESTART_DELAY = 60
+SHARD_METRICS_INTERVAL = 5  # как часто процесс-шард отправляет приращения метрик, сек
 polling_interval = 60  # в минутах
 window = None
+device_table = None
 utc_enabled = None
+utc_recording = False  # писать и <name>_utc_data.csv; копия флажка UTC, которую читают потоки опроса
+DEVICES_FILE = "devices.json"
+ALERTS_FILE = "alerts.json"      # правила тревог (если файла нет — DEFAULT_ALERT_RULES)
+ALERT_LOG_FILE = "alerts_log.csv"
+
+# Модули GUI загружаются только в графическом режиме (см. load_gui_modules)
+tk = messagebox = scrolledtext = ttk = None
+pystray = Image = ImageDraw = None
+
+
+def load_gui_modules():
+    global tk, messagebox, scrolledtext, ttk, pystray, Image, ImageDraw
+    import tkinter as tk
+    from tkinter import messagebox, scrolledtext, ttk
+    import pystray
+    from PIL import Image, ImageDraw
+
+
+def save_devices_to_file(device_list=None):
+    with open(DEVICES_FILE, "w") as file:
+        json.dump(devices if device_list is None else device_list, file)
+
+
+def rename_duplicate_devices(device_list):
+    """Делает имена устройств уникальными («имя (2)», «имя (3)» …); возвращает пары (старое, новое).
+
+    Имя — ключ строки таблицы, расписания опроса и CSV-файлов; старые версии
+    программы разрешали одинаковые имена, и такие devices.json встречаются.
+    """
+    seen = set()
+    renamed = []
+    for device in device_list:
+        name = device["name"]
+        if name in seen:
+            number = 2
+            names = {d["name"] for d in device_list}
+            while f"{name} ({number})" in seen or f"{name} ({number})" in names:
+                number += 1
+            device["name"] = f"{name} ({number})"
+            renamed.append((name, device["name"]))
+        seen.add(device["name"])
+    return renamed
+
+
+def load_devices_from_file(on_renamed=None):
+    """Список устройств из DEVICES_FILE. Повторяющиеся имена переименовываются,
+    файл пересохраняется, а on_renamed(пары) получает список переименований."""
+    try:
+        with open(DEVICES_FILE, "r") as file:
+            loaded = json.load(file)
+    except FileNotFoundError:
+        return []
+    renamed = rename_duplicate_devices(loaded)
+    if renamed:
+        for old, new in renamed:
+            print(f"Duplicate device name {old!r} renamed to {new!r}")
+        save_devices_to_file(loaded)
+        if on_renamed:
+            on_renamed(renamed)
+    return loaded
+
+
+# --- МЕТРИКИ ---
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """Длительности этапов опроса по устройствам (гистограммы) и счётчики исходов.
+
+    observe() — только bisect и пара сложений под коротким lock, поэтому
+    вызывается прямо на горячем пути опроса и записи.
+    """
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self._hist = {}  # (device, stage) -> [счётчики корзин..., +Inf, сумма]
+        self._outcomes = Counter()  # (device, stage, outcome) -> число
+        self._lock = threading.Lock()
+
+    def observe(self, device, stage, seconds, outcome="ok"):
+        key = (device, stage)
+        with self._lock:
+            hist = self._hist.get(key)
+            if hist is None:
+                hist = self._hist[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            hist[bisect.bisect_left(self.buckets, seconds)] += 1
+            hist[-1] += seconds
+            self._outcomes[(device, stage, outcome)] += 1
+
+    def drain(self):
+        """Забирает накопленное с прошлого вызова и обнуляет счётчики: (гистограммы, исходы)."""
+        with self._lock:
+            hists, self._hist = self._hist, {}
+            outcomes, self._outcomes = self._outcomes, Counter()
+        return hists, outcomes
+
+    def merge(self, hists, outcomes):
+        """Добавляет приращения из drain() другого процесса (процессы-шарды, --workers)."""
+        with self._lock:
+            for key, delta in hists.items():
+                hist = self._hist.get(key)
+                if hist is None:
+                    self._hist[key] = list(delta)
+                else:
+                    for i, value in enumerate(delta):
+                        hist[i] += value
+            self._outcomes.update(outcomes)
+
+    @contextmanager
+    def timer(self, device, stage):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException as e:
+            outcome = "timeout" if isinstance(e, (CommandTimeout, asyncio.TimeoutError)) else "error"
+            raise
+        finally:
+            self.observe(device, stage, time.perf_counter() - started, outcome)
+
+    def snapshot(self):
+        with self._lock:
+            hists = {key: list(hist) for key, hist in self._hist.items()}
+            outcomes = dict(self._outcomes)
+        by_stage = {}
+        for (device, stage, outcome), count in outcomes.items():
+            by_stage.setdefault((device, stage), {})[outcome] = count
+        stages = []
+        for (device, stage), hist in sorted(hists.items()):
+            counts = hist[:-1]
+            stages.append({
+                "device": device,
+                "stage": stage,
+                "count": sum(counts),
+                "sum": round(hist[-1], 6),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+                "outcomes": by_stage.get((device, stage), {}),
+            })
+        return {"time": datetime.now().isoformat(timespec="seconds"), "stages": stages}
+
+    def prometheus_text(self):
+        def labels(**kv):
+            return ",".join(f'{k}="{prometheus_escape(str(v))}"' for k, v in kv.items())
+
+        with self._lock:
+            hists = {key: list(hist) for key, hist in self._hist.items()}
+            outcomes = dict(self._outcomes)
+        lines = [
+            "# HELP rpsu_stage_duration_seconds Duration of polling stages per device.",
+            "# TYPE rpsu_stage_duration_seconds histogram",
+        ]
+        for (device, stage), hist in sorted(hists.items()):
+            cumulative = 0
+            for bound, count in zip([str(b) for b in self.buckets] + ["+Inf"], hist[:-1]):
+                cumulative += count
+                lines.append(f"rpsu_stage_duration_seconds_bucket{{{labels(device=device, stage=stage, le=bound)}}}"
+                             f" {cumulative}")
+            lines.append(f"rpsu_stage_duration_seconds_sum{{{labels(device=device, stage=stage)}}} {hist[-1]:.6f}")
+            lines.append(f"rpsu_stage_duration_seconds_count{{{labels(device=device, stage=stage)}}} {cumulative}")
+        lines += [
+            "# HELP rpsu_stage_total Completed polling stages per device by outcome.",
+            "# TYPE rpsu_stage_total counter",
+        ]
+        for (device, stage, outcome), count in sorted(outcomes.items()):
+            lines.append(f"rpsu_stage_total{{{labels(device=device, stage=stage, outcome=outcome)}}} {count}")
+        return "\n".join(lines) + "\n"
 
 
-def save_devices_to_file():
-    with open("devices.json", "w") as file:
-        json.dump(devices, file)
+def prometheus_escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
 
-def load_devices_from_file():
-    try:
-        with open("devices.json", "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return []
+metrics = Metrics()
 
 
-def connect_to_device(ip, port):
-    try:
-        tn = telnetlib.Telnet(ip, port, timeout=5)
-        return tn
-    except Exception as e:
-        print(f"[{ip}] Connection failed: {e}")
-        return None
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, ctype = metrics.prometheus_text(), "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body, ctype = json.dumps(metrics.snapshot(), ensure_ascii=False), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Локальный HTTP-эндпоинт: /metrics (Prometheus) и /metrics.json."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="rpsu-metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def start_metrics_snapshots(filename, interval=60):
+    """Периодически сохраняет снимок метрик в JSON-файл (через временный файл и os.replace)."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                tmp = filename + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(metrics.snapshot(), f, ensure_ascii=False, indent=1)
+                os.replace(tmp, filename)
+            except OSError as e:
+                print(f"Metrics snapshot failed: {e}")
+    threading.Thread(target=run, name="rpsu-metrics-snapshot", daemon=True).start()
 
 
-def send_command(tn, command, delay=1):
-    try:
-        tn.write(command.encode('ascii') + b"\r\n")
-        time.sleep(delay)
-        response = tn.read_very_eager().decode('ascii', errors='ignore')
-        return response
-    except Exception as e:
-        print(f"Command '{command}' failed: {e}")
-        return ""
+# --- ОБМЕН КОМАНДАМИ С МОДЕМОМ ---
+# Признак конца ответа: последняя строка вывода, очищенная от ANSI-последовательностей,
+# целиком совпадает с приглашением меню модема ("RPSU04> ", "MGS4#"). Меняется через --prompt.
+PROMPT_PATTERNS = [r"\w+[>#] ?"]
+PROMPT_RE = re.compile(PROMPT_PATTERNS[0])
+GREETING_TIMEOUT = 3      # ожидание приветствия после подключения, сек
+COMMAND_TIMEOUT = 3       # крайний срок ответа на команду, сек
+COMMAND_TIMEOUTS = {"SHOW": 5, "STATUS": 5}
 
 
-def clean_response(response):
-    # Удаляем ANSI escape sequences (цвета и т.п.)
-    response = re.sub(r'\x1B\[[0-9;]*[a-zA-Z]', '', response)
-    # Оставляем только печатаемые ASCII + переводы строк
-    response = re.sub(r'[^\x20-\x7E\n\r]', '', response)
-    return response.strip()
+def set_prompt_patterns(patterns):
+    global PROMPT_PATTERNS, PROMPT_RE
+    PROMPT_PATTERNS = list(patterns)
+    PROMPT_RE = re.compile("|".join(f"(?:{pattern})" for pattern in PROMPT_PATTERNS))
 
 
-# --- ИЗВЛЕЧЕНИЕ ПАРАМЕТРОВ ---
-def extract_value(response, key):
-    match = re.search(rf"{re.escape(key)}\s*[:=]\s*([-\d.]+)", response, re.IGNORECASE)
-    return match.group(1) if match else "0"
+def is_prompt(data):
+    """Последняя строка вывода — приглашение меню. Ответ, оборванный на «>» или «#», — не приглашение."""
+    tail = data.rstrip()
+    line = tail[max(tail.rfind(b"\n"), tail.rfind(b"\r")) + 1:]
+    return bool(line) and PROMPT_RE.fullmatch(clean_response(line.decode('ascii', errors='ignore'))) is not None
 
 
-def extract_uptime(response):
-    match = re.search(r"RPSU Uptime[:=]\s*(\d+)", response, re.IGNORECASE)
-    return match.group(1) if match else "0"
+class CommandTimeout(Exception):
+    """Модем не вернул приглашение меню до истечения крайнего срока."""
 
+    def __init__(self, command, partial=""):
+        super().__init__(f"Command '{command}' timed out")
+        self.command = command
+        self.partial = partial
 
-def extract_rpsu_status(response):
-    match = re.search(r"RPSU Status[:=]\s*(ON|OFF)", response, re.IGNORECASE)
-    return match.group(1).upper() if match else "OFF"
 
+# Telnet-команды (RFC 854): все опции отклоняются, как это делал telnetlib
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+CONNECT_TIMEOUT = 5       # таймаут TCP-подключения, сек
 
-# 🔥 Ключевое исправление: извлекаем температуру в формате "Temperature : 31.250 C"
-def extract_temperature(response):
-    # Ищем: "Temperature", затем любые пробелы/двоеточие, затем число (возможно с точкой), затем пробел и C
-    # Пример: "Temperature : 31.250 C"
-    match = re.search(r"Temperature\s*[:=]\s*([0-9.]+)\s*C", response, re.IGNORECASE)
-    if match:
+
+class AsyncTelnet:
+    """Неблокирующая Telnet-сессия с модемом поверх asyncio-потоков."""
+
+    def __init__(self, reader, writer, name=""):
+        self.reader = reader
+        self.writer = writer
+        self.name = name  # имя устройства для метрик
+        self._buffer = b""
+        self._raw = b""
+        self._in_sb = False
+
+    @classmethod
+    async def open(cls, ip, port, timeout=CONNECT_TIMEOUT, name=""):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        session = cls(reader, writer, name)
         try:
-            # Приводим к float и обратно к строке — чтобы убрать лишние нули, но сохранить как строку
-            val = float(match.group(1))
-            return f"{val:.1f}"  # Округляем до 1 знака: 31.250 → 31.2
-        except ValueError:
+            # Вычитываем приветствие, чтобы оно не попало в ответ на первую команду
+            await session.read_until_prompt(GREETING_TIMEOUT)
+        except BaseException:
+            session.close()
+            raise
+        return session
+
+    def _filter(self, data):
+        """Убирает из потока служебные последовательности Telnet и отвечает отказом на опции."""
+        buf = self._raw + data
+        out = bytearray()
+        reply = bytearray()
+        i, n = 0, len(buf)
+        while i < n:
+            b = buf[i]
+            if b != IAC:
+                if not self._in_sb:
+                    out.append(b)
+                i += 1
+                continue
+            if i + 1 >= n:
+                break  # неполная последовательность — дождёмся продолжения
+            cmd = buf[i + 1]
+            if cmd in (DO, DONT, WILL, WONT):
+                if i + 2 >= n:
+                    break
+                if cmd == DO:
+                    reply += bytes((IAC, WONT, buf[i + 2]))
+                elif cmd == WILL:
+                    reply += bytes((IAC, DONT, buf[i + 2]))
+                i += 3
+                continue
+            if cmd == IAC and not self._in_sb:
+                out.append(IAC)
+            elif cmd == SB:
+                self._in_sb = True
+            elif cmd == SE:
+                self._in_sb = False
+            i += 2
+        self._raw = buf[i:]
+        if reply:
+            self.writer.write(bytes(reply))
+        return bytes(out)
+
+    async def read_until_prompt(self, timeout):
+        """Читает вывод до приглашения меню. Возвращает (найдено, текст)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if is_prompt(self._buffer):
+                data, self._buffer = self._buffer, b""
+                return True, data.decode('ascii', errors='ignore')
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(4096), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                raise EOFError("connection closed by device")
+            self._buffer += self._filter(chunk)
+        data, self._buffer = self._buffer, b""
+        return False, data.decode('ascii', errors='ignore')
+
+    async def send_command(self, command, timeout=None):
+        if timeout is None:
+            timeout = COMMAND_TIMEOUTS.get(command, COMMAND_TIMEOUT)
+        with metrics.timer(self.name, f"cmd {command}"):
+            self.writer.write(command.encode('ascii') + b"\r\n")
+            await self.writer.drain()
+            found, response = await self.read_until_prompt(timeout)
+            if not found:
+                raise CommandTimeout(command, response)
+        return response
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
             pass
-    return "0.0"
+
+
+# Управляющие ANSI-последовательности и непечатаемые символы — за один проход
+NOISE_RE = re.compile(r'\x1B\[[0-9;]*[a-zA-Z]|[^\x20-\x7E\n\r]')
+
+
+def clean_response(response):
+    return NOISE_RE.sub('', response).strip()
+
+
+# --- ИЗВЛЕЧЕНИЕ ПАРАМЕТРОВ ---
+# Все поля STATUS и SHOW одним скомпилированным выражением: имя сработавшей
+# группы (match.lastgroup) — это имя поля. "Leak Current" стоит раньше
+# "Current", чтобы строка утечки не была принята за ток нагрузки.
+FIELD_RE = re.compile(
+    r"RPSU\s+Status\s*[:=]\s*(?P<status>ON|OFF)\b"
+    r"|RPSU\s+Uptime\s*[:=]\s*(?P<uptime>\d+)"
+    r"|Leak\s+Current\s*[:=]\s*(?P<leak_current>-?[\d.]+)"
+    r"|Voltage\s*[:=]\s*(?P<voltage>-?[\d.]+)"
+    r"|Current\s*[:=]\s*(?P<current>-?[\d.]+)"
+    r"|Temperature\s*[:=]\s*(?P<temperature>[\d.]+)\s*C",
+    re.IGNORECASE,
+)
+FIELD_TYPES = {
+    "status": str.upper,
+    "uptime": int,
+    "voltage": float,
+    "current": float,
+    "leak_current": float,
+    "temperature": float,
+}
+SHOW_FIELDS = ("status", "uptime", "voltage", "current", "leak_current")
+# Значения, которые записываются в CSV вместо отсутствующих полей (как раньше)
+FIELD_DEFAULTS = {
+    "status": "OFF",
+    "uptime": "0",
+    "voltage": "0",
+    "current": "0",
+    "leak_current": "0",
+    "temperature": "0.0",
+}
+
+
+def parse_response(response, fields=tuple(FIELD_TYPES)):
+    """Разбирает очищенный ответ модема за один проход.
+
+    Возвращает словарь {поле: значение} с числами вместо строк; поля из
+    fields, которые не нашлись или не разобрались, равны None и
+    перечислены в "missing".
+    """
+    values = dict.fromkeys(fields)
+    for match in FIELD_RE.finditer(response):
+        name = match.lastgroup
+        if name in values and values[name] is None:
+            try:
+                values[name] = FIELD_TYPES[name](match.group(name))
+            except ValueError:
+                pass
+    values["missing"] = [name for name in fields if values[name] is None]
+    return values
+
+
+def format_number(value):
+    """Число без экспоненты и лишних нулей: 180.50 → "180.5"."""
+    if isinstance(value, int):
+        return str(value)
+    return f"{value:.6f}".rstrip("0").rstrip(".")
+
+
+def format_reading(result):
+    """Значения результата опроса в виде строк для GUI и CSV:
+    (status, uptime, voltage, current, leak_current, temperature)."""
+    values = []
+    for name in FIELD_DEFAULTS:
+        value = result.get(name)
+        if value is None:
+            values.append(FIELD_DEFAULTS[name])
+        elif name == "temperature":
+            values.append(f"{value:.1f}")  # Округляем до 1 знака: 31.250 → 31.2
+        elif name == "status":
+            values.append(value)
+        else:
+            values.append(format_number(value))
+    return tuple(values)
 
 
 # --- ЗАПИСЬ В CSV ---
-def write_to_csv(device_name, rpsu_status, rpsu_uptime, voltage, current, leak_current, temperature):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    filename = f"{device_name}_data.csv"
-    file_exists = os.path.exists(filename)
+# Последние записанные значения по устройствам: перерисовка окна не читает диск
+latest_values = {}
 
-    with open(filename, mode="a", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file, delimiter=";")
-        if not file_exists:
-            writer.writerow(["Timestamp", "Status", "Uptime", "Voltage", "Current", "Leak Current", "Temperature"])
-        writer.writerow([timestamp, rpsu_status, rpsu_uptime, voltage, current, leak_current, temperature])
-    print(f"[{device_name}] Data saved")
+
+CSV_HEADER = ["Timestamp", "Status", "Uptime", "Voltage", "Current", "Leak Current", "Temperature"]
+WRITER_FLUSH_ROWS = 200       # сбрасывать буферы после стольких строк
+WRITER_FLUSH_SECONDS = 2.0    # ... или не позже чем через столько секунд
+WRITER_MAX_OPEN_FILES = 256   # открытых CSV-файлов одновременно
+WRITER_RETRY_ROWS = 10000     # незаписанных строк на файл, которые ждут повтора (старые отбрасываются)
 
 
-def write_to_utc_csv(device_name, rpsu_status, rpsu_uptime, voltage, current, leak_current, temperature):
-    timestamp_utc = (datetime.now() - timedelta(hours=3)).strftime("%Y-%m-%d %H:%M:%S")
+def csv_row(timestamp, rpsu_status, rpsu_uptime, voltage, current, leak_current, temperature):
+    return [timestamp.strftime("%Y-%m-%d %H:%M:%S"), rpsu_status, rpsu_uptime, voltage, current,
+            leak_current, temperature]
+
+
+def utc_csv_row(timestamp, rpsu_status, rpsu_uptime, voltage, current, leak_current, temperature):
+    timestamp_utc = (timestamp - timedelta(hours=3)).strftime("%Y-%m-%d %H:%M:%S")
     status_numeric = 1 if rpsu_status == "ON" else 0
     if status_numeric == 0:
         rpsu_uptime = voltage = current = leak_current = "0"
+    return [timestamp_utc, status_numeric, rpsu_uptime, voltage, current, leak_current, temperature]
+
+
+class CsvWriter:
+    """Единственный поток записи CSV.
+
+    Образцы приходят через очередь, поэтому поток опроса не ждёт диск.
+    Файлы остаются открытыми, строки копятся в буфере и сбрасываются по
+    количеству, по времени и при завершении программы. Строки, которые
+    не удалось записать или сбросить на диск (ошибка часто всплывает только
+    при flush/close), повторяются при следующем сбросе; пока файл в ошибке,
+    новые строки встают за ними, чтобы время в журнале не шло назад.
+    """
+
+    _STOP = object()
+
+    def __init__(self, flush_rows=WRITER_FLUSH_ROWS, flush_seconds=WRITER_FLUSH_SECONDS,
+                 max_open_files=WRITER_MAX_OPEN_FILES, retry_rows=WRITER_RETRY_ROWS):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_open_files = max_open_files
+        self.retry_rows = retry_rows
+        self._queue = queue.Queue()
+        self._files = OrderedDict()  # filename -> (file, csv.writer)
+        self._unflushed = {}          # filename -> строки в буфере файла, ещё не сброшенные на диск
+        self._failed = OrderedDict()  # filename -> deque строк, ждущих повтора
+        self._overflow = set()        # файлы, у которых буфер повтора уже переполнялся
+        self._pending = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self.history = None  # HistoryStore, если включено хранение в SQLite
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name="rpsu-csv-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, device_name, values, utc=False, timestamp=None):
+        """values: (status, uptime, voltage, current, leak_current, temperature)."""
+        latest_values[device_name] = tuple(str(v) for v in values)
+        self.start()
+        self._queue.put((timestamp or datetime.now(), device_name, values, utc))
+
+    def submit_job(self, job):
+        """job(writer) выполнится в потоке записи, когда файлы сброшены на диск."""
+        self.start()
+        self._queue.put(job)
+
+    def release(self, filename):
+        """Закрывает файл, чтобы задание могло его переписать; следующая запись откроет заново."""
+        self._close(filename)
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread:
+            self._queue.put(self._STOP)
+            thread.join(timeout=10)
+
+    def _run(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                self._flush()
+                self._close_all()
+                if self.history:
+                    self.history.close()
+                return
+            if callable(item):
+                # Задание обслуживания (сжатие истории) выполняется между записями
+                self._flush()
+                try:
+                    item(self)
+                except Exception as e:
+                    print(f"Writer job failed: {e}")
+            elif item is not None:
+                self._write(*item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+            if self._pending >= self.flush_rows or (deadline is not None and time.monotonic() >= deadline):
+                self._flush()
+                deadline = time.monotonic() + self.flush_seconds if self._failed else None
+
+    def _write(self, timestamp, device_name, values, utc):
+        started = time.perf_counter()
+        # Локальная и UTC-строки строятся из одной отметки времени
+        self._write_row(f"{device_name}_data.csv", csv_row(timestamp, *values))
+        if utc:
+            self._write_row(f"{device_name}_utc_data.csv", utc_csv_row(timestamp, *values))
+        if self.history:
+            try:
+                self.history.append(device_name, timestamp, values)
+            except sqlite3.Error as e:
+                print(f"History write error ({device_name}): {e}")
+        metrics.observe(device_name, "write", time.perf_counter() - started)
+
+    def _write_row(self, filename, row):
+        if filename in self._failed:
+            self._hold(filename, row)
+            return
+        try:
+            self._open(filename).writerow(row)
+            self._unflushed.setdefault(filename, []).append(row)
+            self._pending += 1
+        except OSError as e:
+            print(f"CSV write error ({filename}): {e}")
+            self._close(filename)
+            self._hold(filename, row)
+
+    def _hold(self, filename, row):
+        rows = self._failed.get(filename)
+        if rows is None:
+            rows = self._failed[filename] = deque(maxlen=self.retry_rows)
+        if len(rows) == rows.maxlen and filename not in self._overflow:
+            self._overflow.add(filename)
+            print(f"CSV retry buffer full ({filename}), dropping the oldest rows")
+        rows.append(row)
+
+    def _requeue(self, filename, rows):
+        """Возвращает строки, пропавшие вместе с буфером файла, в начало очереди повтора."""
+        self._pending = max(0, self._pending - len(rows))
+        held = self._failed.get(filename, ())
+        if len(rows) + len(held) > self.retry_rows and filename not in self._overflow:
+            self._overflow.add(filename)
+            print(f"CSV retry buffer full ({filename}), dropping the oldest rows")
+        queued = deque(rows, maxlen=self.retry_rows)
+        queued.extend(held)
+        self._failed[filename] = queued
+
+    def _retry(self, filename):
+        """Дописывает отложенные строки файла по порядку; при новой ошибке остаток ждёт дальше."""
+        rows = self._failed[filename]
+        try:
+            writer = self._open(filename)
+            while rows:
+                writer.writerow(rows[0])
+                self._unflushed.setdefault(filename, []).append(rows.popleft())
+                self._pending += 1
+        except OSError as e:
+            print(f"CSV write error ({filename}): {e}")
+            self._close(filename)
+            return
+        del self._failed[filename]
+        self._overflow.discard(filename)
+
+    def _open(self, filename):
+        entry = self._files.get(filename)
+        if entry:
+            self._files.move_to_end(filename)
+            return entry[1]
+        if len(self._files) >= self.max_open_files:
+            self._close(next(iter(self._files)))
+        file = open(filename, mode="a", newline="", encoding="utf-8")
+        writer = csv.writer(file, delimiter=";")
+        if file.tell() == 0:
+            writer.writerow(CSV_HEADER)
+        self._files[filename] = (file, writer)
+        return writer
+
+    def _close(self, filename):
+        entry = self._files.pop(filename, None)
+        rows = self._unflushed.pop(filename, [])
+        if entry:
+            try:
+                entry[0].close()
+            except OSError as e:
+                print(f"CSV close error ({filename}): {e}")
+                if rows:
+                    self._requeue(filename, rows)
+
+    def _close_all(self):
+        for filename in list(self._files):
+            self._close(filename)
+
+    def _flush(self):
+        started = time.perf_counter()
+        for filename in list(self._failed):
+            self._retry(filename)
+        for filename, (file, _) in list(self._files.items()):
+            try:
+                file.flush()
+            except OSError as e:
+                print(f"CSV flush error ({filename}): {e}")
+                self._close(filename)
+            else:
+                self._unflushed.pop(filename, None)
+        if self.history:
+            try:
+                self.history.commit()
+            except sqlite3.Error as e:
+                print(f"History commit error: {e}")
+        if self._pending:
+            print(f"CSV: {self._pending} rows saved")
+        self._pending = 0
+        metrics.observe("", "flush", time.perf_counter() - started, "retry" if self._failed else "ok")
 
-    filename = f"{device_name}_utc_data.csv"
-    file_exists = os.path.exists(filename)
 
-    with open(filename, mode="a", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file, delimiter=";")
-        if not file_exists:
-            writer.writerow(["Timestamp", "Status", "Uptime", "Voltage", "Current", "Leak Current", "Temperature"])
-        writer.writerow([timestamp_utc, status_numeric, rpsu_uptime, voltage, current, leak_current, temperature])
-    print(f"[{device_name}] UTC data saved")
+csv_writer = CsvWriter()
+atexit.register(csv_writer.stop)
+
+
+# --- СЫРЫЕ ОТВЕТЫ МОДЕМА (для повторного разбора) ---
+def transcript_filename(device_name, timestamp):
+    return f"{device_name}_raw_{timestamp:%Y-%m}.jsonl.gz"
+
+
+def write_transcripts(pending):
+    for filename, lines in pending.items():
+        try:
+            with gzip.open(filename, "at", encoding="utf-8") as f:
+                f.writelines(lines)
+        except OSError as e:
+            print(f"Transcript write error ({filename}): {e}")
+
+
+def read_transcript(filename):
+    """Записи одного файла сырых ответов по порядку; оборванный хвост (сбой при записи) пропускается."""
+    try:
+        with gzip.open(filename, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+        print(f"Transcript {filename} is truncated: {e}")
+
+
+class TranscriptLog:
+    """Сырые ответы модема по каждому опросу, одна строка JSON на опрос.
+
+    Строки копятся в памяти и дописываются в <name>_raw_<ГГГГ-ММ>.jsonl.gz
+    новым членом gzip в потоке записи CSV, так что файл только растёт.
+    По этим файлам rpsu_reparse.py заново строит CSV исправленным парсером.
+    """
+
+    def __init__(self, flush_lines=500, flush_seconds=60):
+        self.flush_lines = flush_lines
+        self.flush_seconds = flush_seconds
+        self._pending = {}  # filename -> [строки]
+        self._count = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def append(self, device_name, timestamp, result):
+        record = {"ts": timestamp.strftime("%Y-%m-%d %H:%M:%S"), "state": result["state"], **result["raw"]}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._pending.setdefault(transcript_filename(device_name, timestamp), []).append(line)
+            self._count += 1
+            due = self._count >= self.flush_lines or time.monotonic() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._count = 0
+            self._last_flush = time.monotonic()
+        if pending:
+            csv_writer.submit_job(lambda writer: write_transcripts(pending))
+
+
+transcripts = TranscriptLog()
+atexit.register(transcripts.flush)  # выполнится раньше csv_writer.stop
+
+
+# --- ХРАНИЛИЩЕ ИСТОРИИ (SQLite) ---
+def to_number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class HistoryStore:
+    """История опросов в SQLite: числа вместо строк, индекс (device_id, ts).
+
+    Пишет только поток CsvWriter (append/commit), чтение по диапазону времени
+    открывает собственное соединение, поэтому не мешает записи (режим WAL).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS devices (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS samples (
+            device_id INTEGER NOT NULL REFERENCES devices(id),
+            ts INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            uptime INTEGER,
+            voltage REAL,
+            current REAL,
+            leak_current REAL,
+            temperature REAL
+        );
+        CREATE INDEX IF NOT EXISTS samples_device_ts ON samples (device_id, ts);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._device_ids = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    def _device_id(self, device_name):
+        device_id = self._device_ids.get(device_name)
+        if device_id is None:
+            self._conn.execute("INSERT OR IGNORE INTO devices (name) VALUES (?)", (device_name,))
+            device_id = self._conn.execute("SELECT id FROM devices WHERE name = ?", (device_name,)).fetchone()[0]
+            self._device_ids[device_name] = device_id
+        return device_id
+
+    def append(self, device_name, timestamp, values):
+        if self._conn is None:
+            self._conn = self._connect()
+        rpsu_status, rpsu_uptime, voltage, current, leak_current, temperature = values
+        self._conn.execute(
+            "INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self._device_id(device_name), int(timestamp.timestamp()), 1 if rpsu_status == "ON" else 0,
+             to_number(rpsu_uptime, int), to_number(voltage), to_number(current),
+             to_number(leak_current), to_number(temperature)),
+        )
+
+    def commit(self):
+        if self._conn is not None:
+            self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    def purge_before(self, cutoff):
+        """Удаляет образцы старше cutoff (их заменяют агрегаты). Вызывается из потока записи."""
+        if self._conn is None:
+            self._conn = self._connect()
+        deleted = self._conn.execute("DELETE FROM samples WHERE ts < ?", (int(cutoff.timestamp()),)).rowcount
+        self._conn.commit()
+        return deleted
+
+    def query(self, device_name, start=None, end=None):
+        """Образцы устройства за [start, end) — список кортежей
+        (datetime, status, uptime, voltage, current, leak_current, temperature)."""
+        lo = int(start.timestamp()) if start else 0
+        hi = int(end.timestamp()) if end else 2 ** 62
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT s.ts, s.status, s.uptime, s.voltage, s.current, s.leak_current, s.temperature "
+                "FROM samples s JOIN devices d ON d.id = s.device_id "
+                "WHERE d.name = ? AND s.ts >= ? AND s.ts < ? ORDER BY s.ts",
+                (device_name, lo, hi),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(datetime.fromtimestamp(ts), "ON" if status else "OFF", *rest) for ts, status, *rest in rows]
+
+    def export_csv(self, device_name, filename, start=None, end=None):
+        """Выгружает диапазон в CSV того же формата, что <name>_data.csv."""
+        rows = self.query(device_name, start, end)
+        with open(filename, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file, delimiter=";")
+            writer.writerow(CSV_HEADER)
+            for timestamp, *values in rows:
+                writer.writerow(csv_row(timestamp, *("" if v is None else v for v in values)))
+        return len(rows)
+
+
+def read_last_csv_row(filename, block_size=4096):
+    """Читает последнюю строку CSV с конца файла, не разбирая всю историю."""
+    with open(filename, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        data = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+            lines = data.rstrip(b"\r\n").split(b"\n")
+            if len(lines) > 1:
+                return next(csv.reader([lines[-1].decode('utf-8')], delimiter=';'))
+        # В файле одна строка — это заголовок
+        return None
 
 
 def get_last_data_from_csv(device_name):
+    cached = latest_values.get(device_name)
+    if cached:
+        return cached
     try:
         filename = f"{device_name}_data.csv"
         if not os.path.exists(filename):
             return "", "", "", "", "", ""
 
-        with open(filename, 'r', encoding='utf-8') as f:
-            reader = list(csv.reader(f, delimiter=';'))
-            if len(reader) > 1:
-                last = reader[-1]
-                return (
-                    last[1] if len(last) > 1 else "",
-                    last[2] if len(last) > 2 else "",
-                    last[3] if len(last) > 3 else "",
-                    last[4] if len(last) > 4 else "",
-                    last[5] if len(last) > 5 else "",
-                    last[6] if len(last) > 6 else ""
-                )
+        last = read_last_csv_row(filename)
+        if last:
+            values = tuple(last[i] if len(last) > i else "" for i in range(1, 7))
+            latest_values[device_name] = values
+            return values
     except Exception as e:
         print(f"CSV read error: {e}")
     return "", "", "", "", "", ""
 
 
+class LineIndex:
+    """Смещения строк CSV-файла для постраничного чтения журнала.
+
+    Индекс дополняется порциями (extend) и может строиться в фоновом потоке,
+    пока окно журнала уже показывает первые строки.
+    """
+
+    TIMESTAMP_LEN = len("YYYY-MM-DD HH:MM:SS")
+
+    def __init__(self, filename, chunk_size=1 << 20):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.offsets = array('Q', [0])  # строка i занимает offsets[i]..offsets[i + 1]
+        self.complete = False
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def extend(self):
+        """Индексирует следующую порцию файла. Возвращает False, когда файл дочитан."""
+        pos = self.offsets[-1]
+        with open(self.filename, 'rb') as f:
+            if f.seek(0, os.SEEK_END) < pos:
+                # Файл переписан при ротации — индексируем заново
+                self.offsets = array('Q', [0])
+                pos = 0
+            f.seek(pos)
+            data = f.read(self.chunk_size)
+        i = data.find(b"\n")
+        while i >= 0:
+            self.offsets.append(pos + i + 1)
+            i = data.find(b"\n", i + 1)
+        self.complete = len(data) < self.chunk_size
+        return not self.complete
+
+    def follow(self, stop, interval=1.0):
+        """Строит индекс до конца файла и затем подхватывает дописанные строки."""
+        while not stop.is_set():
+            try:
+                more = self.extend()
+            except OSError as e:
+                print(f"Journal index error: {e}")
+                return
+            if not more:
+                stop.wait(interval)
+
+    def read_lines(self, start, count):
+        end = min(start + count, len(self))
+        if start >= end:
+            return []
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offsets[start])
+            data = f.read(self.offsets[end] - self.offsets[start])
+        return data.decode('utf-8', errors='replace').splitlines()
+
+    def find_timestamp(self, timestamp):
+        """Номер первой строки данных с отметкой времени не раньше timestamp (двоичный поиск)."""
+        key = timestamp.encode('ascii', errors='ignore')
+        lo, hi = 1, len(self)
+        with open(self.filename, 'rb') as f:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                f.seek(self.offsets[mid])
+                if f.read(self.TIMESTAMP_LEN) < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return lo
+
+
+# --- АГРЕГАТЫ, ХРАНЕНИЕ И РОТАЦИЯ ИСТОРИИ ---
+ROLLUP_PERIODS = ("hourly", "daily")
+ROLLUP_METRICS = (("Voltage", 3), ("Current", 4), ("Leak Current", 5), ("Temperature", 6))
+ROLLUP_HEADER = ["Period", "Samples", "ON %"] + [
+    f"{metric} {stat}" for metric, _ in ROLLUP_METRICS for stat in ("min", "max", "avg")
+]
+COMPACT_INTERVAL = 3600  # как часто проверять, не пора ли сжать историю, сек
+
+
+def rollup_max_hold():
+    """Дольше этого строка журнала не считается действующей (дальше — пропуск в данных), сек."""
+    return max(HEARTBEAT_INTERVAL, polling_interval * 60 * MAX_BACKOFF) * (1 + POLL_JITTER)
+
+
+class Rollups:
+    """Почасовые и суточные агрегаты (min/max/avg и доля времени ON) по строкам сырого журнала.
+
+    Значение строки действует до следующей строки, но не дольше max_hold
+    и не позже end. Доля ON и средние взвешены по этому времени, поэтому
+    учащённый опрос аварийных устройств (--adaptive) и пропуск повторов
+    (--deadband) их не искажают. Samples — число строк в периоде.
+    """
+
+    def __init__(self, end=None, max_hold=None):
+        self.end = end
+        self.max_hold = timedelta(seconds=max_hold or rollup_max_hold())
+        self.buckets = {period: {} for period in ROLLUP_PERIODS}
+        self._pending = None  # (время, ON?, значения) строки, длительность которой ещё неизвестна
+
+    def _bucket(self, period, key):
+        bucket = self.buckets[period].get(key)
+        if bucket is None:
+            # [строк, секунд ON, секунд всего, затем по каждой величине: min, max, сумма value*сек, секунд]
+            bucket = self.buckets[period][key] = [0, 0.0, 0.0] + [None, None, 0.0, 0.0] * len(ROLLUP_METRICS)
+        return bucket
+
+    def add(self, row):
+        try:
+            moment = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return
+        if self._pending:
+            self._hold(*self._pending, moment)
+        values = [to_number(row[col]) if len(row) > col else None for _, col in ROLLUP_METRICS]
+        self._pending = (moment, row[1] == "ON", values)
+        for period, key in zip(ROLLUP_PERIODS, (row[0][:13] + ":00", row[0][:10])):
+            bucket = self._bucket(period, key)
+            bucket[0] += 1
+            self._extremes(bucket, values)
+
+    def finish(self):
+        """Учитывает последнюю строку: она действует до end (или max_hold)."""
+        if self._pending:
+            moment = self._pending[0]
+            self._hold(*self._pending, self.end or moment + self.max_hold)
+            self._pending = None
+
+    @staticmethod
+    def _extremes(bucket, values):
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            j = 3 + i * 4
+            bucket[j] = value if bucket[j] is None else min(bucket[j], value)
+            bucket[j + 1] = value if bucket[j + 1] is None else max(bucket[j + 1], value)
+
+    def _hold(self, moment, on, values, until):
+        """Раскладывает время действия строки [moment, until) по часам и суткам."""
+        until = min(until, moment + self.max_hold)
+        if self.end:
+            until = min(until, self.end)
+        start = moment
+        while start < until:
+            stop = min(until, start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1))
+            seconds = (stop - start).total_seconds()
+            hour = start.strftime("%Y-%m-%d %H:00")
+            for period, key in zip(ROLLUP_PERIODS, (hour, hour[:10])):
+                bucket = self._bucket(period, key)
+                bucket[1] += seconds if on else 0.0
+                bucket[2] += seconds
+                if start != moment:
+                    self._extremes(bucket, values)  # значение продолжает действовать в следующем часе
+                for i, value in enumerate(values):
+                    if value is not None:
+                        bucket[5 + i * 4] += value * seconds
+                        bucket[6 + i * 4] += seconds
+            start = stop
+
+    @staticmethod
+    def format(key, bucket):
+        on_share = format_number(round(100.0 * bucket[1] / bucket[2], 1)) if bucket[2] else ""
+        row = [key, bucket[0], on_share]
+        for i in range(len(ROLLUP_METRICS)):
+            lo, hi, total, seconds = bucket[3 + i * 4:7 + i * 4]
+            if lo is None:
+                row += ["", "", ""]
+            else:
+                row += [format_number(lo), format_number(hi),
+                        format_number(round(total / seconds, 3)) if seconds else ""]
+        return row
+
+    def write(self, device_name):
+        """Сливает агрегаты с файлами по ключу периода: повтор пересчитывает период, а не дублирует его.
+
+        Каждый файл пишется во временный и заменяется целиком.
+        """
+        for period in ROLLUP_PERIODS:
+            buckets = self.buckets[period]
+            if not buckets:
+                continue
+            filename = f"{device_name}_{period}.csv"
+            rows = {row[0]: row for row in read_rollups(device_name, period)}
+            rows.update((key, self.format(key, bucket)) for key, bucket in buckets.items())
+            tmp = filename + ".tmp"
+            try:
+                with open(tmp, mode="w", newline="", encoding="utf-8") as file:
+                    writer = csv.writer(file, delimiter=";")
+                    writer.writerow(ROLLUP_HEADER)
+                    writer.writerows(rows[key] for key in sorted(rows))
+                os.replace(tmp, filename)
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+
+def read_rollups(device_name, period="daily", start=None, end=None):
+    """Строки агрегатов за [start, end) — start/end в формате отметок времени CSV или None."""
+    filename = f"{device_name}_{period}.csv"
+    if not os.path.exists(filename):
+        return []
+    with open(filename, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=";")
+        next(reader, None)
+        return [row for row in reader if row and (not start or row[0] >= start[:len(row[0])])
+                and (not end or row[0] < end[:len(row[0])])]
+
+
+def read_first_csv_row(filename):
+    with open(filename, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=";")
+        next(reader, None)
+        return next(reader, None)
+
+
+def rotate_csv(filename, cutoff, rollups=None, before_replace=None):
+    """Переносит строки старше cutoff в сжатый архив <имя>.archive.csv.gz.
+
+    Архив — цепочка gzip-членов, по одному на ротацию; gzip.open читает её
+    как один поток. Строки для архива сначала пишутся во временный член,
+    который дописывается к архиву только после успешной замены журнала,
+    чтобы повтор после ошибки не дублировал данные. before_replace()
+    (запись агрегатов) вызывается до замены журнала: если она не удалась,
+    журнал остаётся прежним. Возвращает число перенесённых строк.
+    """
+    tmp = filename + ".tmp"
+    archive = filename[:-len(".csv")] + ".archive.csv.gz"
+    part = archive + ".part"
+    moved = 0
+    with open(filename, newline="", encoding="utf-8") as src, \
+            open(tmp, "w", newline="", encoding="utf-8") as dst, \
+            gzip.open(part, "wt", newline="", encoding="utf-8") as arc:
+        reader = csv.reader(src, delimiter=";")
+        header = next(reader, None) or CSV_HEADER
+        kept = csv.writer(dst, delimiter=";")
+        archived = csv.writer(arc, delimiter=";")
+        kept.writerow(header)
+        if not os.path.exists(archive):
+            archived.writerow(header)
+        for row in reader:
+            if row and row[0] < cutoff:
+                archived.writerow(row)
+                moved += 1
+                if rollups is not None:
+                    rollups.add(row)
+            elif row:
+                kept.writerow(row)
+    try:
+        if before_replace:
+            before_replace()
+        os.replace(tmp, filename)
+    except OSError:
+        os.remove(tmp)
+        os.remove(part)
+        raise
+    with open(part, "rb") as src, open(archive, "ab") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(part)
+    return moved
+
+
+def compact_history(writer, device_names, retention_days, now=None):
+    """Сжимает историю старше retention_days: агрегаты + ротация сырых CSV.
+
+    Выполняется в потоке записи (CsvWriter.submit_job), который на время
+    ротации закрывает свои дескрипторы этих файлов. Граница выравнивается
+    на полночь, поэтому в агрегаты попадают только целые часы и сутки.
+    """
+    now = now or datetime.now()
+    cutoff = (now - timedelta(days=retention_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    cutoff_local = cutoff.strftime("%Y-%m-%d %H:%M:%S")
+    cutoff_utc = (cutoff - timedelta(hours=3)).strftime("%Y-%m-%d %H:%M:%S")
+    for name in device_names:
+        raw = f"{name}_data.csv"
+        try:
+            first = read_first_csv_row(raw) if os.path.exists(raw) else None
+            if first and first[0] < cutoff_local:
+                writer.release(raw)
+                rollups = Rollups(end=cutoff)
+
+                def save_rollups():
+                    rollups.finish()
+                    rollups.write(name)
+                moved = rotate_csv(raw, cutoff_local, rollups, save_rollups)
+                print(f"[{name}] Compacted {moved} raw rows into rollups")
+            utc = f"{name}_utc_data.csv"
+            first = read_first_csv_row(utc) if os.path.exists(utc) else None
+            if first and first[0] < cutoff_utc:
+                writer.release(utc)
+                rotate_csv(utc, cutoff_utc)
+        except OSError as e:
+            print(f"[{name}] Compaction failed: {e}")
+    if writer.history:
+        try:
+            writer.history.purge_before(cutoff)
+        except sqlite3.Error as e:
+            print(f"History purge failed: {e}")
+
+
+def start_compaction(retention_days, interval=COMPACT_INTERVAL):
+    """Фоновое сжатие истории: раз в interval ставит задание в очередь потока записи."""
+    def run():
+        delay = 60  # первый проход — после загрузки списка устройств
+        while True:
+            time.sleep(delay)
+            delay = interval
+            names = [d["name"] for d in devices]
+            csv_writer.submit_job(lambda w, names=names: compact_history(w, names, retention_days))
+    threading.Thread(target=run, name="rpsu-compaction", daemon=True).start()
+
+
 # --- ОСНОВНАЯ ЛОГИКА ОПРОСА ---
-def device_monitoring(device, status_var, uptime_var, voltage_var, current_var, leak_current_var, temperature_var, temperature_label):
-    global polling_interval, window
+STATE_TEXT = {
+    "no_link": "Нет связи",
+    "no_rpsu": "Нет RPSU",
+    "timeout": "Таймаут",
+    "error": "Ошибка",
+}
+
+
+def parse_show(cleaned_show, temperature, name=""):
+    started = time.perf_counter()
+    result = parse_response(cleaned_show, SHOW_FIELDS)
+    result["state"] = "ok"
+    result["temperature"] = temperature
+    if temperature is None:
+        result["missing"].append("temperature")
+    metrics.observe(name, "parse", time.perf_counter() - started, "missing" if result["missing"] else "ok")
+    return result
+
+
+def parse_transcript(record, name=""):
+    """Разбор сохранённых ответов одного опроса (TranscriptLog) тем же путём, что и при опросе."""
+    temperature = parse_response(clean_response(record.get("status", "")), ("temperature",))["temperature"]
+    if temperature is None:
+        temperature = record.get("temperature")  # опрос через открытую сессию: прежнее значение
+    if "echo" in record and "04" not in clean_response(record["echo"]):
+        return {"state": "no_rpsu"}
+    if "show" not in record:
+        return {"state": record.get("state", "error")}
+    return parse_show(clean_response(record["show"]), temperature, name)
+
+
+class SessionPool:
+    """Сессии, оставленные открытыми в меню платы RPSU между циклами опроса.
+
+    Хранит не больше limit простаивающих сессий: при переполнении
+    закрывается та, что дольше всех не использовалась.
+    """
+
+    def __init__(self, limit=MAX_IDLE_SESSIONS):
+        self.limit = limit
+        self._idle = OrderedDict()  # name -> (адрес, сессия, последняя температура)
+
+    def take(self, device):
+        entry = self._idle.pop(device["name"], None)
+        if not entry:
+            return None
+        address, session, temperature = entry
+        if address != (device["ip"], device["port"]) or session.reader.at_eof():
+            session.close()
+            return None
+        return session, temperature
+
+    def park(self, device, session, temperature):
+        self.discard(device["name"])
+        self._idle[device["name"]] = ((device["ip"], device["port"]), session, temperature)
+        while len(self._idle) > self.limit:
+            _, (_, oldest, _) = self._idle.popitem(last=False)
+            oldest.close()
+
+    def discard(self, name):
+        entry = self._idle.pop(name, None)
+        if entry:
+            entry[1].close()
+
+    def retain(self, names):
+        for name in [n for n in self._idle if n not in names]:
+            self.discard(name)
+
+    def close_all(self):
+        self.retain(())
+
+
+async def poll_parked_session(session, temperature, raw=None):
+    """Опрос через открытую сессию: только SHOW и STATUS, без навигации по меню."""
+    show_resp = await session.send_command("SHOW")
+    status_resp = await session.send_command("STATUS")
+    if raw is not None:
+        raw.update(show=show_resp, status=status_resp, temperature=temperature)
+    cleaned_show = clean_response(show_resp)
+    cleaned_status = clean_response(status_resp)
+    # В меню платы STATUS может не содержать температуру — оставляем прежнее значение
+    reading = parse_response(cleaned_status, ("temperature",))
+    if reading["temperature"] is not None:
+        temperature = reading["temperature"]
+    return parse_show(cleaned_show, temperature, session.name)
+
+
+async def poll_device_async(device, sessions=None):
+    started = time.perf_counter()
+    result = await _poll_device(device, sessions)
+    metrics.observe(device["name"], "poll", time.perf_counter() - started, result["state"])
+    return result
+
+
+async def probe_device(device, timeout=PROBE_TIMEOUT):
+    """Проверка TCP-порта без Telnet-диалога: True, если подключение установилось."""
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(device["ip"], device["port"]), timeout)
+    except (OSError, asyncio.TimeoutError):
+        metrics.observe(device["name"], "probe", time.perf_counter() - started, "down")
+        return False
+    writer.close()
+    metrics.observe(device["name"], "probe", time.perf_counter() - started, "up")
+    return True
+
+
+async def probe_fleet(device_list, timeout=PROBE_TIMEOUT, concurrency=PROBE_CONCURRENCY):
+    """Параллельная проверка портов всего списка: {name: доступен}."""
+    limit = asyncio.Semaphore(concurrency)
+
+    async def probe(device):
+        async with limit:
+            return device["name"], await probe_device(device, timeout)
+
+    return dict(await asyncio.gather(*(probe(d) for d in device_list)))
+
+
+async def _poll_device(device, sessions):
+    """Один цикл опроса: 2 → STATUS → %1 → ECHO → %104 → 1 → SHOW.
+
+    Если передан пул sessions, сессия после опроса остаётся в меню платы RPSU,
+    и следующий цикл повторяет только SHOW и STATUS. Оборванная сессия
+    незаметно заменяется новым подключением.
+    """
     ip = device["ip"]
     name = device["name"]
+    raw = {} if capture_transcripts else None
+
+    def captured(result):
+        if raw:
+            result["raw"] = raw
+        return result
+
+    parked = sessions.take(device) if sessions is not None else None
+    if parked:
+        session, temperature = parked
+        session.name = name
+        result = None
+        try:
+            result = await poll_parked_session(session, temperature, raw)
+        except Exception as e:
+            print(f"[{name}] Session lost, reconnecting: {e}")
+        finally:
+            if result is None:
+                session.close()
+        if result is not None:
+            sessions.park(device, session, result["temperature"])
+            return captured(result)
+        if raw:
+            raw.clear()
 
-    while True:
-        tn = connect_to_device(ip, device["port"])
-        if not tn:
-            status_var.set("Нет связи")
-            if window:
-                window.after(0, lambda: temperature_label.config(fg="black"))
-            time.sleep(polling_interval * 60)
-            continue
-
-        temperature = "0.0"
-        rpsu_status = "OFF"
-        rpsu_uptime = "0"
-        voltage = "0"
-        current = "0"
-        leak_current = "0"
+    try:
+        with metrics.timer(name, "connect"):
+            session = await AsyncTelnet.open(ip, device["port"], name=name)
+    except (OSError, EOFError, asyncio.TimeoutError) as e:
+        print(f"[{ip}] Connection failed: {e}")
+        return {"state": "no_link"}
 
+    keep = False
+    try:
+        # 1. Вход в меню модема
+        await session.send_command("2")
+
+        # 2. Получаем температуру ДО входа в RPSU-меню!
+        status_resp = await session.send_command("STATUS")
+        temperature = parse_response(clean_response(status_resp), ("temperature",))["temperature"]
+        if raw is not None:
+            raw["status"] = status_resp
+
+        # 3. Переходим к платам
+        await session.send_command("%1")
+        echo_resp = await session.send_command("ECHO")
+        if raw is not None:
+            raw["echo"] = echo_resp
+        if "04" not in clean_response(echo_resp):
+            return captured({"state": "no_rpsu"})
+
+        # 4. Подключаемся к RPSU (плата 04)
+        await session.send_command("%104")
+        await session.send_command("1")
+        show_resp = await session.send_command("SHOW")
+        if raw is not None:
+            raw["show"] = show_resp
+        cleaned_show = clean_response(show_resp)
+
+        # 5. Извлекаем RPSU-параметры
+        result = parse_show(cleaned_show, temperature, name)
+        if result["missing"]:
+            print(f"[{name}] Missing fields: {', '.join(result['missing'])}")
+        if sessions is not None:
+            sessions.park(device, session, temperature)
+            keep = True
+        return captured(result)
+    except CommandTimeout as e:
+        print(f"[{name}] {e}")
+        return captured({"state": "timeout"})
+    except Exception as e:
+        print(f"[{name}] Error in loop: {e}")
+        return captured({"state": "error"})
+    finally:
+        if not keep:
+            session.close()
+
+
+# --- АДАПТИВНЫЙ ОПРОС И ЗАПИСЬ ПО ИЗМЕНЕНИЮ ---
+# Изменения меньше зоны нечувствительности считаются шумом измерения
+DEADBAND = {"voltage": 0.5, "current": 0.5, "leak_current": 0.05, "temperature": 0.5}
+# Изменение за один опрос больше этого — значения «быстро меняются»
+FAST_CHANGE = {"voltage": 5.0, "current": 5.0, "leak_current": 0.2, "temperature": 2.0}
+
+
+def reading_changed(result, previous, limits):
+    """True, если статус сменился, плата перезапустилась или поле ушло от previous дальше limits."""
+    if result.get("status") != previous.get("status"):
+        return True
+    if (result.get("uptime") or 0) < (previous.get("uptime") or 0):
+        return True
+    for name, limit in limits.items():
+        value, old = result.get(name), previous.get(name)
+        if (value is None) != (old is None) or (value is not None and abs(value - old) > limit):
+            return True
+    return False
+
+
+def is_urgent(result):
+    """Авария платы или перегрев модема."""
+    return result.get("status") == "OFF" or (result.get("temperature") or 0.0) > HOT_TEMPERATURE
+
+
+def adaptive_interval(entry, result, base):
+    """Интервал до следующего опроса устройства, сек.
+
+    entry — запись PollScheduler: в ней хранятся последнее чтение и число
+    стабильных опросов подряд. При аварии, перегреве или быстром изменении
+    интервал сокращается до FAST_POLL_INTERVAL, при стабильных значениях
+    удваивается каждые STABLE_POLLS опросов, но не больше MAX_BACKOFF раз.
+    """
+    if result["state"] != "ok":
+        entry["stable"] = 0
+        return base
+    previous, entry["reading"] = entry.get("reading"), result
+    if is_urgent(result) or (previous is not None and reading_changed(result, previous, FAST_CHANGE)):
+        entry["stable"] = 0
+        return min(base, FAST_POLL_INTERVAL)
+    if previous is not None and not reading_changed(result, previous, DEADBAND):
+        entry["stable"] = entry.get("stable", 0) + 1
+    else:
+        entry["stable"] = 0
+    return base * min(MAX_BACKOFF, 2 ** (entry["stable"] // STABLE_POLLS))
+
+
+def trip_breaker(entry):
+    """Размыкает цепь устройства: следующая проверка через удвоенную паузу, сек."""
+    entry["down"] = True
+    entry["backoff"] = min(BREAKER_MAX_BACKOFF, entry["backoff"] * 2) if entry.get("backoff") else BREAKER_BACKOFF
+    return entry["backoff"]
+
+
+def circuit_breaker(entry, result, interval):
+    """Интервал до следующего опроса с учётом размыкателя цепи.
+
+    После BREAKER_FAILURES неудачных опросов подряд (нет связи, таймаут,
+    нет платы 04, обрыв сессии) устройство считается недоступным: вместо Telnet-опроса его порт
+    проверяется probe_device с паузой, растущей до BREAKER_MAX_BACKOFF.
+    Когда порт отвечает, выполняется пробный полный опрос (полуоткрытое
+    состояние); удачный опрос замыкает цепь, неудачный — размыкает снова.
+    """
+    if result["state"] == "ok":
+        if entry.get("down"):
+            print(f"[{entry['device']['name']}] Reachable again")
+        entry["failures"] = entry["backoff"] = 0
+        entry["down"] = False
+        return interval
+    entry["failures"] = entry.get("failures", 0) + 1
+    if entry.get("down") or entry["failures"] >= BREAKER_FAILURES:
+        delay = trip_breaker(entry)
+        print(f"[{entry['device']['name']}] Unreachable ({result['state']}), next check in {delay:.0f} s")
+        return delay
+    return interval
+
+
+class DeadbandRecorder:
+    """Отбирает чтения для записи в CSV, когда включена запись по изменению.
+
+    Чтение пишется, если какое-то поле ушло из DEADBAND относительно
+    последней записанной строки или с неё прошло heartbeat секунд
+    («пульс»: устройство на связи, значения прежние). Перед строкой
+    с изменением пишется последнее пропущенное чтение, чтобы ступенька
+    на графике оказалась на своём месте.
+    """
+
+    def __init__(self, heartbeat=HEARTBEAT_INTERVAL):
+        self.heartbeat = heartbeat
+        self._last = {}   # name -> (время, result) последней записанной строки
+        self._held = {}   # name -> (время, result) последнего пропущенного чтения
+        self._lock = threading.Lock()
+
+    def filter(self, name, result, now):
+        """Возвращает список (время, result), которые нужно записать."""
+        with self._lock:
+            last = self._last.get(name)
+            if last and not reading_changed(result, last[1], DEADBAND):
+                if (now - last[0]).total_seconds() < self.heartbeat:
+                    self._held[name] = (now, result)
+                    return []
+                rows = [(now, result)]
+            else:
+                held = self._held.get(name)
+                rows = [held, (now, result)] if held else [(now, result)]
+            self._held.pop(name, None)
+            self._last[name] = (now, result)
+            return rows
+
+    def clear(self):
+        """Забывает состояние (запись по изменению выключена — следующая строка пишется всегда)."""
+        with self._lock:
+            self._last.clear()
+            self._held.clear()
+
+
+deadband = DeadbandRecorder()
+
+
+# --- ТРЕВОГИ ---
+DEFAULT_ALERT_RULES = [
+    {"name": "Авария ДП", "kind": "equals", "field": "status", "value": "OFF"},
+    {"name": "Перегрев", "kind": "threshold", "field": "temperature", "above": HOT_TEMPERATURE,
+     "clear": HOT_TEMPERATURE - 1, "debounce": 2},
+    {"name": "Рост утечки", "kind": "drift", "field": "leak_current", "limit": 0.3, "clear": 0.15, "alpha": 0.05},
+    {"name": "Скачок напряжения", "kind": "rate", "field": "voltage", "limit": 10, "clear": 5},
+    {"name": "Нет связи", "kind": "equals", "field": "state", "value": "no_link", "debounce": 3,
+     "clear_debounce": 1},
+]
+
+
+class AlertRule:
+    """Одно правило тревоги из alerts.json.
+
+    kind:
+      threshold — значение выше "above" (или ниже "below"), снятие после "clear";
+      equals    — поле равно "value" (status == "OFF", state == "no_link");
+      rate      — скорость изменения больше "limit" единиц в минуту, снятие ниже "clear";
+      drift     — отклонение от медленной средней (EWMA, вес "alpha") больше "limit".
+    Гистерезис задаёт "clear", защиту от дребезга — "debounce" (и "clear_debounce"):
+    сколько опросов подряд условие должно выполняться. "devices" — список устройств,
+    к которым относится правило (по умолчанию ко всем).
+    """
+
+    KINDS = ("threshold", "equals", "rate", "drift")
+    NUMERIC_FIELDS = tuple(name for name, kind in FIELD_TYPES.items() if kind in (int, float))
+
+    def __init__(self, spec):
+        self.name = spec["name"]
+        self.kind = spec.get("kind", "threshold")
+        self.field = spec["field"]
+        if self.kind not in self.KINDS:
+            raise ValueError(f"{self.name}: unknown kind {self.kind!r}")
+        if self.kind != "equals" and self.field not in self.NUMERIC_FIELDS:
+            raise ValueError(f"{self.name}: {self.kind} needs a numeric field, not {self.field!r}")
+        self.devices = set(spec["devices"]) if spec.get("devices") else None
+        self.debounce = int(spec.get("debounce", 1))
+        self.clear_debounce = int(spec.get("clear_debounce", self.debounce))
+        self.sign = 1.0
+        if self.kind == "threshold":
+            if "below" in spec:
+                self.sign = -1.0  # «ниже» сводится к «выше» для отрицательного значения
+                self.limit = -float(spec["below"])
+                self.clear = -float(spec.get("clear", spec["below"]))
+            else:
+                self.limit = float(spec["above"])
+                self.clear = float(spec.get("clear", spec["above"]))
+        elif self.kind == "equals":
+            self.value = spec["value"]
+            self.limit = self.clear = 0.5
+        else:
+            self.limit = float(spec["limit"])
+            self.clear = float(spec.get("clear", self.limit))
+            self.alpha = float(spec.get("alpha", 0.05))
+
+    def measure(self, value, now, state):
+        """Величина, сравниваемая с limit/clear; None — пока не с чем сравнить."""
+        if self.kind == "threshold":
+            return self.sign * value
+        if self.kind == "equals":
+            return 1.0 if value == self.value else 0.0
+        if self.kind == "rate":
+            previous, state["previous"] = state.get("previous"), (now, value)
+            if previous is None or now <= previous[0]:
+                return None
+            return abs(value - previous[1]) / (now - previous[0]) * 60
+        baseline = state.get("baseline")
+        if baseline is None:
+            state["baseline"] = value
+            return None
+        return value - baseline
+
+    def settle(self, value, state):
+        # Средняя для drift обновляется только без тревоги, чтобы рост утечки не «растворился» в ней
+        if self.kind == "drift" and not state["active"] and "baseline" in state:
+            state["baseline"] += self.alpha * (value - state["baseline"])
+
+
+def load_alert_rules(path=None):
+    """Правила из alerts.json; при отсутствии файла или ошибке в нём — DEFAULT_ALERT_RULES."""
+    path = path or ALERTS_FILE
+    if os.path.exists(path):
         try:
-            # 1. Вход в меню модема
-            _ = send_command(tn, "2", delay=1)
-
-            # 2. Получаем температуру ДО входа в RPSU-меню!
-            status_resp = send_command(tn, "STATUS", delay=1)
-            cleaned_temp = clean_response(status_resp)
-            temperature = extract_temperature(cleaned_temp)
-
-            # 3. Переходим к платам
-            _ = send_command(tn, "%1", delay=1)
-            echo_resp = send_command(tn, "ECHO", delay=1)
-            cleaned_echo = clean_response(echo_resp)
-
-            if "04" not in cleaned_echo:
-                status_var.set("Нет RPSU")
-                tn.close()
-                time.sleep(polling_interval * 60)
+            with open(path, encoding="utf-8") as f:
+                return [AlertRule(spec) for spec in json.load(f)]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Alert rules error in {path}: {e}; using defaults")
+    return [AlertRule(spec) for spec in DEFAULT_ALERT_RULES]
+
+
+class AlertEngine:
+    """Проверяет каждый результат опроса по правилам по мере поступления.
+
+    Для пары (устройство, правило) хранится только маленькое состояние
+    (активна ли тревога, счётчик дребезга, предыдущее значение или средняя),
+    поэтому проверка одного результата стоит O(число правил) — история не
+    перечитывается, и размер парка на стоимость не влияет.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._state = {}   # (name, rule.name) -> dict
+        self._active = {}  # name -> {rule.name, ...}
+        self._broken = set()  # правила, на которых проверка уже падала (сообщаем один раз)
+        self._lock = threading.Lock()
+
+    def evaluate(self, name, result, now):
+        """Возвращает события: словари {time, device, rule, event: "raise"|"clear", value}."""
+        events = []
+        with self._lock:
+            for rule in self.rules:
+                if rule.devices is not None and name not in rule.devices:
+                    continue
+                value = result.get(rule.field)
+                if value is None:
+                    continue
+                state = self._state.setdefault((name, rule.name), {"active": False, "count": 0})
+                try:
+                    measured = rule.measure(value, now, state)
+                except (TypeError, ValueError, ArithmeticError) as e:
+                    # Ошибка одного правила не должна мешать остальным и записи данных
+                    if rule.name not in self._broken:
+                        self._broken.add(rule.name)
+                        print(f"Alert rule {rule.name} failed on {name}: {e}")
+                    continue
+                if measured is not None:
+                    crossed = measured < rule.clear if state["active"] else measured > rule.limit
+                    state["count"] = state["count"] + 1 if crossed else 0
+                    if state["count"] >= (rule.clear_debounce if state["active"] else rule.debounce):
+                        state["active"] = not state["active"]
+                        state["count"] = 0
+                        active = self._active.setdefault(name, set())
+                        (active.add if state["active"] else active.discard)(rule.name)
+                        events.append({"time": now, "device": name, "rule": rule.name,
+                                       "event": "raise" if state["active"] else "clear", "value": value})
+                rule.settle(value, state)
+        return events
+
+    def active(self, name):
+        with self._lock:
+            return sorted(self._active.get(name, ()))
+
+    def active_count(self):
+        with self._lock:
+            return sum(len(names) for names in self._active.values())
+
+    def forget(self, name):
+        with self._lock:
+            self._active.pop(name, None)
+            for rule in self.rules:
+                self._state.pop((name, rule.name), None)
+
+
+class AlertLog:
+    """Журнал тревог alerts_log.csv: только дописывается, по строке на событие."""
+
+    HEADER = ["Timestamp", "Device", "Alert", "Event", "Value"]
+
+    def __init__(self, filename=ALERT_LOG_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        row = [datetime.fromtimestamp(event["time"]).strftime("%Y-%m-%d %H:%M:%S"), event["device"],
+               event["rule"], event["event"], event["value"]]
+        with self._lock:
+            try:
+                with open(self.filename, mode="a", newline="", encoding="utf-8") as file:
+                    writer = csv.writer(file, delimiter=";")
+                    if file.tell() == 0:
+                        writer.writerow(self.HEADER)
+                    writer.writerow(row)
+            except OSError as e:
+                print(f"Alert log write error ({self.filename}): {e}")
+
+
+alert_engine = AlertEngine([AlertRule(spec) for spec in DEFAULT_ALERT_RULES])
+alert_log = AlertLog()
+
+
+def check_alerts(device, result):
+    """Проверяет результат опроса по правилам тревог, пишет события в журнал и stdout."""
+    events = alert_engine.evaluate(device["name"], result, time.time())
+    for event in events:
+        alert_log.write(event)
+        action = "ALERT" if event["event"] == "raise" else "Cleared"
+        print(f"[{event['device']}] {action}: {event['rule']} ({event['value']})")
+    return events
+
+
+class GuiUpdater:
+    """Доставляет результаты опроса в таблицу устройств из главного потока Tk.
+
+    Потоки опроса только складывают значения в общий буфер (post), где
+    для каждого устройства и поля остаётся лишь последнее значение.
+    Главный цикл Tk забирает буфер раз в tick_ms и передаёт в таблицу
+    только поля, значение которых действительно изменилось.
+    """
+
+    def __init__(self, tick_ms=GUI_TICK_MS):
+        self.tick_ms = tick_ms
+        self._pending = {}   # name -> {поле: значение}
+        self._shown = {}     # name -> {поле: показанное значение}
+        self._lock = threading.Lock()
+        self._window = None
+        self.table = None
+
+    def start(self, window_local, table):
+        self._window = window_local
+        self.table = table
+        window_local.after(self.tick_ms, self._tick)
+
+    def forget(self, name):
+        """Сбрасывает показанные значения устройства (строка удалена или создана заново)."""
+        self._shown.pop(name, None)
+
+    def post(self, name, updates):
+        """Можно вызывать из любого потока."""
+        with self._lock:
+            self._pending.setdefault(name, {}).update(updates)
+
+    def _tick(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for name, updates in pending.items():
+            shown = self._shown.setdefault(name, {})
+            changed = {f: v for f, v in updates.items() if shown.get(f) != v}
+            if not changed:
                 continue
-
-            # 4. Подключаемся к RPSU (плата 04)
-            _ = send_command(tn, "%104", delay=1)
-            _ = send_command(tn, "1", delay=1)
-            show_resp = send_command(tn, "SHOW", delay=2)
-            cleaned_show = clean_response(show_resp)
-
-            # 5. Извлекаем RPSU-параметры
-            rpsu_status = extract_rpsu_status(cleaned_show)
-            rpsu_uptime = extract_uptime(cleaned_show)
-            voltage = extract_value(cleaned_show, "Voltage")
-            current = extract_value(cleaned_show, "Current")
-            leak_current = extract_value(cleaned_show, "Leak Current")
-
-            # 6. Обновляем GUI
-            status_display = "Авария" if rpsu_status == "OFF" else rpsu_status
-            status_var.set(status_display)
-            uptime_var.set(rpsu_uptime)
-            voltage_var.set(voltage)
-            current_var.set(current)
-            leak_current_var.set(leak_current)
-            temperature_var.set(temperature)
-
-            # --- ЦВЕТОВОЕ ИНДИКАТОРНОЕ УВЕДОМЛЕНИЕ (без окон!) ---
             try:
-                temp_val = float(temperature)
-            except ValueError:
-                temp_val = 0.0
+                if self.table.update_row(name, changed):
+                    shown.update(changed)
+            except Exception as e:
+                print(f"GUI update failed ({name}): {e}")
+        self._window.after(self.tick_ms, self._tick)
+
+
+gui_updates = GuiUpdater()
+
+
+def apply_poll_result(device, result):
+    """Передаёт результат опроса в GUI (через gui_updates), данные — в CSV, тревоги — в таблицу и трей."""
+    state = result["state"]
+    if state != "ok":
+        updates = {"status": STATE_TEXT[state]}
+        if state == "no_link":
+            updates["temperature_color"] = "black"
+        gui_updates.post(device["name"], updates)
+        # Строки CSV нет, но сырые ответы (--capture) неудачного опроса сохраняются
+        record_result(device, result, utc_recording)
+        show_alerts(device, result)
+        return
 
-            def update_temp_color():
-                try:
-                    if temp_val > 40.0:
-                        temperature_label.config(fg="orange")  # 🔶 только оранжевый (по ТЗ)
-                    else:
-                        temperature_label.config(fg="black")
-                except Exception as e:
-                    print(f"GUI color update failed: {e}")
+    rpsu_status, uptime, voltage, current, leak_current, temperature = format_reading(result)
+
+    # 6. Обновляем GUI
+    # --- ЦВЕТОВОЕ ИНДИКАТОРНОЕ УВЕДОМЛЕНИЕ (без окон!) ---
+    temp_val = result["temperature"] or 0.0
+    gui_updates.post(device["name"], {
+        "status": "Авария" if rpsu_status == "OFF" else rpsu_status,
+        "uptime": uptime,
+        "voltage": voltage,
+        "current": current,
+        "leak_current": leak_current,
+        "temperature": temperature,
+        "temperature_color": "orange" if temp_val > HOT_TEMPERATURE else "black",  # 🔶 только оранжевый (по ТЗ)
+    })
+
+    # 7. Запись в CSV
+    record_result(device, result, utc_recording)
+
+    # 8. Тревоги
+    show_alerts(device, result)
+
+
+def show_alerts(device, result):
+    """Проверяет результат по правилам тревог и показывает активные тревоги в таблице и трее."""
+    if check_alerts(device, result):
+        gui_updates.post(device["name"], {"alerts": ", ".join(alert_engine.active(device["name"]))})
+        update_tray_alerts()
+
+
+def record_result(device, result, utc=False):
+    """Записывает успешный результат опроса в CSV (и в UTC-файл при utc=True)."""
+    now = datetime.now()
+    if "raw" in result:
+        transcripts.append(device["name"], now, result)
+    if result["state"] != "ok":
+        return
+    if not deadband_recording:
+        csv_writer.submit(device["name"], format_reading(result), utc, now)
+        return
+    for timestamp, reading in deadband.filter(device["name"], result, now):
+        csv_writer.submit(device["name"], format_reading(reading), utc, timestamp)
 
-            if window:
-                window.after(0, update_temp_color)
-            else:
-                update_temp_color()
 
-            # 7. Запись в CSV
-            write_to_csv(name, rpsu_status, rpsu_uptime, voltage, current, leak_current, temperature)
-            if utc_enabled and utc_enabled.get():
-                write_to_utc_csv(name, rpsu_status, rpsu_uptime, voltage, current, leak_current, temperature)
+class PollScheduler:
+    """Единая очередь сроков опроса (heap) для всего парка устройств.
 
-        except Exception as e:
-            print(f"[{name}] Error in loop: {e}")
-            status_var.set("Ошибка")
+    Записи не удаляются из heap сразу: у каждой есть номер, и устаревшие
+    элементы (удалённое устройство, перенесённый срок) пропускаются при извлечении.
+    """
+
+    def __init__(self, jitter=POLL_JITTER):
+        self.jitter = jitter
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, name):
+        return self._entries.get(name)
+
+    def names(self):
+        return list(self._entries)
+
+    def add(self, name, entry, due):
+        entry["last_start"] = None
+        entry["running"] = False
+        self._entries[name] = entry
+        self._push(name, due)
+
+    def remove(self, name):
+        return self._entries.pop(name, None)
+
+    def _push(self, name, due):
+        seq = next(self._seq)
+        entry = self._entries[name]
+        entry["due"] = due
+        entry["seq"] = seq
+        heapq.heappush(self._heap, (due, seq, name))
+
+    def _spread(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def next_due(self):
+        while self._heap:
+            due, seq, name = self._heap[0]
+            entry = self._entries.get(name)
+            if entry and entry["seq"] == seq and not entry["running"]:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now):
+        """Возвращает имена устройств, срок опроса которых наступил."""
+        ready = []
+        while self.next_due() is not None and self._heap[0][0] <= now:
+            _, _, name = heapq.heappop(self._heap)
+            self._entries[name]["running"] = True
+            ready.append(name)
+        return ready
+
+    def move(self, name, due):
+        """Переносит срок ожидающего (не опрашиваемого сейчас) устройства."""
+        if name in self._entries and not self._entries[name]["running"]:
+            self._push(name, due)
+
+    def done(self, name, started, interval):
+        """Планирует следующий опрос через interval секунд от начала предыдущего."""
+        entry = self._entries.get(name)
+        if entry is None:
+            return
+        entry["running"] = False
+        entry["last_start"] = started
+        self._push(name, started + self._spread(interval))
+
+    def retime(self, now, interval):
+        """Пересчитывает сроки ожидающих устройств под новый интервал.
+
+        Отключённые (открытый автомат) ждут свою паузу до конца.
+        """
+        for name, entry in self._entries.items():
+            if entry["running"] or entry.get("down"):
+                continue
+            base = entry["last_start"] if entry["last_start"] is not None else now
+            self._push(name, max(now, base + self._spread(interval)))
+
+
+class AsyncPoller:
+    """Опрашивает все устройства в одном потоке с event loop asyncio.
+
+    Число одновременных Telnet-сессий ограничено semaphore, поэтому
+    количество потоков и открытых сокетов не растёт вместе со списком устройств.
+    Сроки опроса хранит один PollScheduler; event loop взводит единственный
+    таймер на ближайший срок.
+    """
+
+    def __init__(self, concurrency=MAX_CONCURRENT_POLLS):
+        self.concurrency = concurrency
+        self._loop = None
+        self._limit = None
+        self._timer = None
+        self._tasks = {}
+        self._probes = set()
+        self._retimed = polling_interval
+        self.schedule = PollScheduler()
+        self.sessions = SessionPool()
+
+    def start(self):
+        if self._loop:
+            return
+        self._retimed = polling_interval
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="rpsu-poller", daemon=True).start()
+
+    def set_devices(self, entries):
+        """entries: список пар (device, on_result).
+
+        Новые устройства ставятся в очередь, удалённые снимаются с опроса,
+        у оставшихся обновляются параметры без сдвига их сроков.
+        """
+        self.start()
+        self._loop.call_soon_threadsafe(self._sync_devices, list(entries))
+
+    def interval_changed(self):
+        """Применяет новый polling_interval сразу, не дожидаясь текущих сроков.
+
+        Если интервал не изменился, сроки (и адаптивные интервалы) не трогаются.
+        """
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._retime)
+
+    def _interval(self, device):
+        return polling_interval * 60
+
+    def _sync_devices(self, entries):
+        now = self._loop.time()
+        wanted = {device["name"]: (device, on_result) for device, on_result in entries}
+        if len(wanted) < len(entries):
+            print(f"Duplicate device names: {len(entries) - len(wanted)} devices are not polled")
+        for name in self.schedule.names():
+            if name not in wanted:
+                self.schedule.remove(name)
+                task = self._tasks.pop(name, None)
+                if task:
+                    task.cancel()
+        self.sessions.retain(set(wanted))
+        added = []
+        for name, (device, on_result) in wanted.items():
+            entry = self.schedule.get(name)
+            if entry:
+                entry["device"] = device
+                entry["on_result"] = on_result
+            else:
+                # Первый опрос новых устройств разносим во времени, чтобы не нагружать сеть разом
+                due = now + random.uniform(0, min(START_SPREAD, self._interval(device)))
+                self.schedule.add(name, {"device": device, "on_result": on_result}, due)
+                added.append(device)
+        if added:
+            task = self._loop.create_task(self._probe_added(added))
+            self._probes.add(task)
+            task.add_done_callback(self._probes.discard)
+        self._arm()
+
+    async def _probe_added(self, added):
+        """Проверяет порты новых устройств разом; недоступные сразу считаются отключёнными."""
+        reachable = await probe_fleet(added)
+        for name, up in reachable.items():
+            entry = self.schedule.get(name)
+            if up or entry is None or entry["running"] or entry.get("down"):
+                continue
+            entry["failures"] = BREAKER_FAILURES
+            delay = trip_breaker(entry)
+            print(f"[{name}] Port closed, next check in {delay:.0f} s")
+            self._deliver(name, entry, {"state": "no_link"})
+            self.schedule.move(name, self._loop.time() + delay)
+        self._arm()
+
+    def _deliver(self, name, entry, result):
+        if self.schedule.get(name) is entry:
+            try:
+                entry["on_result"](result)
+            except Exception as e:
+                print(f"[{name}] Result handling failed: {e}")
+
+    def _retime(self):
+        if polling_interval == self._retimed:
+            return
+        self._retimed = polling_interval
+        self.schedule.retime(self._loop.time(), polling_interval * 60)
+        self._arm()
+
+    def _arm(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        due = self.schedule.next_due()
+        if due is not None:
+            self._timer = self._loop.call_at(due, self._dispatch)
+
+    def _dispatch(self):
+        self._timer = None
+        for name in self.schedule.pop_due(self._loop.time()):
+            self._tasks[name] = self._loop.create_task(self._poll(name))
+        self._arm()
+
+    async def _poll(self, name):
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        entry = self.schedule.get(name)
+        device = entry["device"]
+        started = self._loop.time()
+        interval = self._interval(device)
+        try:
+            if entry.get("down") and not await probe_device(device):
+                # Цепь разомкнута и порт закрыт — Telnet-опрос и место в очереди не тратим
+                interval = trip_breaker(entry)
+                self._deliver(name, entry, {"state": "no_link"})
+                return
+            async with self._limit:
+                sessions = self.sessions if keep_alive_sessions else None
+                result = await poll_device_async(device, sessions)
+            if adaptive_polling:
+                interval = adaptive_interval(entry, result, interval)
+            interval = circuit_breaker(entry, result, interval)
+            self._deliver(name, entry, result)
         finally:
+            if self._tasks.get(name) is asyncio.current_task():
+                del self._tasks[name]
+            if self.schedule.get(name) is entry:
+                self.schedule.done(name, started, interval)
+                self._arm()
+
+    def close_sessions(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self.sessions.close_all)
+
+    def stop(self):
+        """Останавливает опрос и закрывает открытые сессии."""
+        if not self._loop:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _shutdown(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        tasks = list(self._tasks.values()) + list(self._probes)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.sessions.close_all()
+
+
+poller = AsyncPoller()
+
+
+# --- ОПРОС В НЕСКОЛЬКИХ ПРОЦЕССАХ ---
+RESULT_FIELDS = tuple(FIELD_TYPES)
+
+
+def pack_result(name, result):
+    """Результат опроса в виде кортежа для передачи между процессами."""
+    return (name, result["state"], result.get("raw")) + tuple(result.get(field) for field in RESULT_FIELDS)
+
+
+def unpack_result(record):
+    name, state, raw, *values = record
+    result = {"state": state}
+    if raw is not None:
+        result["raw"] = raw
+    if state == "ok":
+        result.update(zip(RESULT_FIELDS, values))
+        result["missing"] = [field for field, value in zip(RESULT_FIELDS, values) if value is None]
+    return name, result
+
+
+def poll_settings(concurrency):
+    return {
+        "polling_interval": polling_interval,
+        "keep_alive_sessions": keep_alive_sessions,
+        "adaptive_polling": adaptive_polling,
+        "capture_transcripts": capture_transcripts,
+        "prompt_patterns": PROMPT_PATTERNS,
+        "concurrency": concurrency,
+    }
+
+
+def apply_poll_settings(settings):
+    global polling_interval, keep_alive_sessions, adaptive_polling, capture_transcripts
+    polling_interval = settings["polling_interval"]
+    keep_alive_sessions = settings["keep_alive_sessions"]
+    adaptive_polling = settings["adaptive_polling"]
+    capture_transcripts = settings["capture_transcripts"]
+    set_prompt_patterns(settings["prompt_patterns"])
+
+
+def shard_for(name, shards):
+    """Номер процесса для устройства (rendezvous hashing).
+
+    При выходе процесса из набора переезжают только его устройства,
+    остальные остаются на месте вместе со своими сроками опроса.
+    """
+    key = name.encode("utf-8")
+    return max(shards, key=lambda index: hashlib.blake2b(key, digest_size=8,
+                                                         salt=index.to_bytes(16, "little")).digest())
+
+
+def shard_worker(index, settings, commands, results):
+    """Процесс-шард: опрашивает свою часть устройств и отправляет результаты в очередь results."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # остановкой управляет основной процесс
+    if sys.stdout:
+        sys.stdout.reconfigure(line_buffering=True)
+    apply_poll_settings(settings)
+    local = AsyncPoller(settings["concurrency"])
+
+    def on_result(name):
+        return lambda result: results.put(pack_result(name, result))
+
+    def send_metrics():
+        # Запись с name=None — приращения метрик этапов для основного процесса
+        hists, outcomes = metrics.drain()
+        if hists:
+            results.put((None, hists, outcomes))
+
+    while True:
+        try:
+            command, payload = commands.get(timeout=SHARD_METRICS_INTERVAL)
+        except queue.Empty:
+            send_metrics()
+            continue
+        if command == "devices":
+            local.set_devices([(device, on_result(device["name"])) for device in payload])
+        elif command == "settings":
+            apply_poll_settings(payload)
+            local.interval_changed()
+            if not keep_alive_sessions:
+                local.close_sessions()
+        elif command == "stop":
+            local.stop()
+            send_metrics()
+            return
+
+
+class ShardedPoller:
+    """Делит устройства между процессами shard_worker и собирает их результаты.
+
+    Интерфейс тот же, что у AsyncPoller: GUI и режим без GUI не знают,
+    сколько процессов опрашивают устройства. Опрос и разбор ответов идут
+    в процессах-шардах, а результаты (pack_result) и приращения метрик
+    приходят в основной процесс, где их обрабатывает on_result — запись CSV,
+    окно и /metrics остаются здесь.
+    Упавший процесс перезапускается; пока его нет, устройства опрашивают остальные.
+    """
+
+    def __init__(self, workers, concurrency=MAX_CONCURRENT_POLLS):
+        self.workers = workers
+        self.concurrency = concurrency
+        self._ctx = multiprocessing.get_context("spawn")
+        self._results = None
+        self._procs = {}        # index -> (process, очередь команд, время запуска)
+        self._restart_at = {}   # index -> срок перезапуска (time.monotonic)
+        self._crashes = Counter()
+        self._entries = {}      # name -> (device, on_result)
+        self._settings = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._collector = None
+
+    def start(self):
+        with self._lock:
+            if self._results is not None:
+                return
+            self._results = self._ctx.Queue()
+            for index in range(self.workers):
+                self._spawn(index)
+        self._collector = threading.Thread(target=self._collect, name="rpsu-shard-results", daemon=True)
+        self._collector.start()
+        threading.Thread(target=self._supervise, name="rpsu-shard-supervisor", daemon=True).start()
+        atexit.register(self.stop)
+
+    def _worker_settings(self):
+        return poll_settings(max(1, -(-self.concurrency // self.workers)))
+
+    def _spawn(self, index):
+        self._settings = self._worker_settings()
+        commands = self._ctx.Queue()
+        process = self._ctx.Process(target=shard_worker, name=f"rpsu-shard-{index}", daemon=True,
+                                    args=(index, self._settings, commands, self._results))
+        process.start()
+        self._procs[index] = (process, commands, time.monotonic())
+
+    def _live(self):
+        return [index for index, (process, _, _) in self._procs.items() if process.is_alive()]
+
+    def _send(self, index, command, payload=None):
+        try:
+            self._procs[index][1].put((command, payload))
+        except (OSError, ValueError) as e:
+            print(f"Shard {index}: command failed: {e}")
+
+    def _rebalance(self):
+        live = self._live()
+        if not live:
+            return
+        shards = {index: [] for index in live}
+        for name, (device, _) in self._entries.items():
+            shards[shard_for(name, live)].append(device)
+        for index, shard in shards.items():
+            self._send(index, "devices", shard)
+
+    def set_devices(self, entries):
+        """entries: список пар (device, on_result); on_result вызывается в потоке сборщика результатов."""
+        self.start()
+        with self._lock:
+            self._entries = {device["name"]: (device, on_result) for device, on_result in entries}
+            self._rebalance()
+
+    def _broadcast_settings(self):
+        self._settings = self._worker_settings()
+        for index in self._live():
+            self._send(index, "settings", self._settings)
+
+    def interval_changed(self):
+        with self._lock:
+            if self._results is not None:
+                self._broadcast_settings()
+
+    def close_sessions(self):
+        self.interval_changed()
+
+    def _supervise(self):
+        while not self._stopped.wait(1):
+            with self._lock:
+                if self._stopped.is_set():
+                    return
+                now = time.monotonic()
+                changed = False
+                for index, (process, _, started) in self._procs.items():
+                    if process.is_alive() or index in self._restart_at:
+                        continue
+                    if now - started > SHARD_MAX_RESTART_DELAY:
+                        self._crashes[index] = 0
+                    delay = min(SHARD_MAX_RESTART_DELAY, SHARD_RESTART_DELAY * 2 ** self._crashes[index])
+                    self._crashes[index] += 1
+                    print(f"Shard {index} exited (code {process.exitcode}), restarting in {delay} s")
+                    self._restart_at[index] = now + delay
+                    changed = True
+                for index, due in list(self._restart_at.items()):
+                    if due <= now:
+                        del self._restart_at[index]
+                        self._spawn(index)
+                        changed = True
+                if changed:
+                    self._rebalance()
+                elif self._settings != self._worker_settings():
+                    # Флажки GUI меняют глобальные настройки — доносим их до процессов
+                    self._broadcast_settings()
+
+    def _collect(self):
+        while True:
             try:
-                tn.close()
-            except:
-                pass
-            time.sleep(polling_interval * 60)
+                record = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+            if record[0] is None:
+                metrics.merge(record[1], record[2])
+                continue
+            name, result = unpack_result(record)
+            entry = self._entries.get(name)
+            if entry is None:
+                continue
+            try:
+                entry[1](result)
+            except Exception as e:
+                print(f"[{name}] Result handling failed: {e}")
+
+    def stop(self):
+        """Останавливает процессы-шарды и дожидается обработки их последних результатов."""
+        with self._lock:
+            if self._results is None or self._stopped.is_set():
+                return
+            self._stopped.set()
+            for index in self._live():
+                self._send(index, "stop")
+            procs = [process for process, _, _ in self._procs.values()]
+        for process in procs:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._collector.join(timeout=10)
+
+
+# --- ГРАФИКИ: ЗАГРУЗКА И ПРОРЕЖИВАНИЕ ИСТОРИИ (NumPy) ---
+TREND_COLUMNS = (3, 4, 5, 6)  # Voltage, Current, Leak Current, Temperature в <name>_data.csv
+EPOCH = datetime(1970, 1, 1)
+
+
+def trend_seconds(moment):
+    """Локальное время CSV в секундах той же шкалы, что datetime64 у NumPy (без часового пояса)."""
+    return (moment - EPOCH).total_seconds()
+
+
+def trend_datetime(seconds):
+    return EPOCH + timedelta(seconds=float(seconds))
+
+
+def find_csv_offset(f, timestamp):
+    """Смещение первой строки CSV с отметкой времени не раньше timestamp.
+
+    Двоичный поиск по байтам открытого в режиме "rb" файла: не нужен ни
+    индекс строк, ни чтение файла целиком.
+    """
+    key = timestamp.encode('ascii')
+    size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    header_end = len(f.readline())
+
+    def line_start(pos):
+        f.seek(pos - 1)
+        f.readline()
+        return f.tell()
+
+    lo, hi = header_end, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = line_start(mid)
+        f.seek(start)
+        if start >= size or f.read(len(key)) >= key:
+            hi = mid
+        else:
+            lo = mid + 1
+    return line_start(lo)
+
+
+def load_trend(device_name, start=None, end=None):
+    """История устройства в массивах NumPy: (t, lo, hi).
+
+    t — секунды (float64, см. trend_seconds), lo/hi — массивы (n, 4) минимумов и
+    максимумов напряжения, тока, тока утечки и температуры. Сырые строки
+    дают lo == hi; период, уже перенесённый в архив, берётся из почасовых
+    агрегатов (их min/max). start/end — datetime или None.
+    """
+    import numpy as np
+
+    fmt = "%Y-%m-%d %H:%M:%S"
+    parts = []
+    raw_file = f"{device_name}_data.csv"
+    raw_first = None
+    if os.path.exists(raw_file):
+        dtype = [("ts", "M8[s]")] + [(f"v{i}", "f8") for i in range(len(TREND_COLUMNS))]
+        with open(raw_file, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(find_csv_offset(f, start.strftime(fmt)) if start else 0)
+            if not start:
+                f.readline()
+            if f.tell() < size:
+                # Оборванная при сбое строка (за ней дописываются новые) не должна ломать весь файл
+                fields = len(CSV_HEADER) - 1
+                lines = (line.decode("utf-8", "replace") for line in f if line.count(b";") == fields)
+                rows = np.loadtxt(lines, delimiter=";", usecols=(0,) + TREND_COLUMNS, dtype=dtype, ndmin=1)
+            else:
+                rows = np.empty(0, dtype=dtype)
+        if len(rows):
+            t = rows["ts"].astype("int64").astype("float64")
+            values = np.column_stack([rows[f"v{i}"] for i in range(len(TREND_COLUMNS))])
+            raw_first = rows["ts"][0]
+            parts.append((t, values, values))
+
+    # Агрегаты нужны только для времени раньше первой сырой строки
+    rollup_end = str(raw_first).replace("T", " ") if raw_first is not None else None
+    hourly = read_rollups(device_name, "hourly", start and start.strftime(fmt), rollup_end)
+    if hourly:
+        def number(value):
+            return float(value) if value else np.nan
+        t = np.array([row[0] for row in hourly], dtype="M8[s]").astype("int64").astype("float64")
+        table = np.array([[number(v) for v in row[3:]] for row in hourly], dtype="float64")
+        # В агрегатах по каждой величине идут min, max, avg
+        parts.insert(0, (t, table[:, 0::3], table[:, 1::3]))
+
+    if not parts:
+        empty = np.empty((0, len(TREND_COLUMNS)))
+        return np.empty(0), empty, empty
+    t = np.concatenate([p[0] for p in parts])
+    lo = np.concatenate([p[1] for p in parts])
+    hi = np.concatenate([p[2] for p in parts])
+    if end is not None:
+        keep = t < trend_seconds(end)
+        t, lo, hi = t[keep], lo[keep], hi[keep]
+    if len(t) > 1 and np.any(np.diff(t) < 0):
+        order = np.argsort(t, kind="stable")
+        t, lo, hi = t[order], lo[order], hi[order]
+    return t, lo, hi
+
+
+def minmax_downsample(t, lo, hi, t0, t1, width):
+    """Прореживание до ширины графика: для каждого пиксельного столбца — min и max.
+
+    Возвращает (столбцы, min, max); точек не больше width, сколько бы ни
+    было исходных образцов, и экстремумы (выбросы тока утечки) не теряются.
+    """
+    import numpy as np
+
+    width = max(int(width), 2)
+    i0, i1 = np.searchsorted(t, [t0, t1], side="left")
+    t, lo, hi = t[i0:i1 + 1], lo[i0:i1 + 1], hi[i0:i1 + 1]
+    if not len(t):
+        return np.empty(0, dtype=np.int64), lo, hi
+    span = max(t1 - t0, 1.0)
+    cols = np.clip(((t - t0) * (width - 1) / span).astype(np.int64), 0, width - 1)
+    starts = np.flatnonzero(np.r_[True, cols[1:] != cols[:-1]])
+    return cols[starts], np.fmin.reduceat(lo, starts, axis=0), np.fmax.reduceat(hi, starts, axis=0)
 
 
 # --- GUI: вспомогательные функции ---
+class JournalViewer:
+    """Окно журнала: на экране только видимые строки, они читаются с диска по LineIndex."""
+
+    ROWS = 30
+
+    def __init__(self, device_name):
+        filename = f"{device_name}_data.csv"
+        self.win = tk.Toplevel()
+        self.win.title(f"Журнал — {device_name}")
+        if not os.path.exists(filename):
+            tk.Label(self.win, text="Файл журнала не найден.", font=("Courier", 9)).pack(padx=10, pady=10)
+            return
+
+        self.index = LineIndex(filename)
+        self.first = 1
+        self.shown = 0
+
+        top = tk.Frame(self.win)
+        top.pack(fill="x", padx=10, pady=(10, 0))
+        tk.Label(top, text="Перейти к (ГГГГ-ММ-ДД ЧЧ:ММ:СС):").pack(side="left")
+        self.jump_entry = tk.Entry(top, width=20)
+        self.jump_entry.pack(side="left", padx=5)
+        self.jump_entry.bind("<Return>", lambda e: self.jump())
+        tk.Button(top, text="Перейти", command=self.jump).pack(side="left")
+        tk.Button(top, text="График", command=lambda: show_trend_chart(device_name)).pack(side="left", padx=5)
+        self.info = tk.Label(top, text="Индексация...")
+        self.info.pack(side="right")
+
+        body = tk.Frame(self.win)
+        body.pack(fill="both", expand=True, padx=10, pady=10)
+        self.header = tk.Label(body, font=("Courier", 9, "bold"), anchor="w")
+        self.header.grid(row=0, column=0, sticky="ew")
+        self.text = tk.Text(body, width=90, height=self.ROWS, font=("Courier", 9), wrap="none")
+        self.text.grid(row=1, column=0, sticky="nsew")
+        self.scroll = tk.Scrollbar(body, command=self.on_scroll)
+        self.scroll.grid(row=1, column=1, sticky="ns")
+        self.text.config(state=tk.DISABLED)
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.text.bind(seq, self.on_wheel)
+
+        self.stop = threading.Event()
+        self.win.bind("<Destroy>", lambda e: self.stop.set() if e.widget is self.win else None)
+        threading.Thread(target=self.index.follow, args=(self.stop,), daemon=True).start()
+        self.refresh()
+
+    @property
+    def total(self):
+        """Число строк данных (без заголовка)."""
+        return max(len(self.index) - 1, 0)
+
+    def refresh(self):
+        if self.stop.is_set():
+            return
+        total = self.total
+        if not self.header.cget("text") and len(self.index):
+            self.header.config(text=self.index.read_lines(0, 1)[0])
+        state = "" if self.index.complete else " (индексация...)"
+        self.info.config(text=f"Строк: {total}{state}")
+        # Перерисовываем, только если в видимом окне появились новые строки
+        if self.shown < self.ROWS and total >= self.first + self.shown:
+            self.render(self.first)
+        self.win.after(500, self.refresh)
+
+    def render(self, first):
+        total = self.total
+        first = max(1, min(first, total - self.ROWS + 1))
+        lines = self.index.read_lines(first, self.ROWS)
+        self.first, self.shown = first, len(lines)
+        self.text.config(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, "\n".join(lines))
+        self.text.config(state=tk.DISABLED)
+        if total:
+            self.scroll.set((first - 1) / total, (first - 1 + len(lines)) / total)
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.render(1 + int(float(amount) * self.total))
+        else:
+            step = self.ROWS if unit == "pages" else 1
+            self.render(self.first + int(amount) * step)
+
+    def on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.render(self.first - 3)
+        else:
+            self.render(self.first + 3)
+        return "break"
+
+    def jump(self):
+        timestamp = self.jump_entry.get().strip()
+        if timestamp:
+            self.render(self.index.find_timestamp(timestamp))
+
+
+class TrendChart:
+    """Окно графиков напряжения, тока, тока утечки и температуры за выбранный период.
+
+    История загружается в фоновом потоке (load_trend), а на холст выводится
+    не больше двух точек на пиксель (minmax_downsample), поэтому год
+    минутных данных рисуется так же быстро, как сутки.
+    """
+
+    RANGES = (("Сутки", 1), ("Неделя", 7), ("Месяц", 30), ("Год", 365), ("Всё", None))
+    PANELS = (("Напряжение (В)", "blue"), ("Ток (mA)", "green"),
+              ("Ток утечки (mA)", "red"), ("Температура (°C)", "orange"))
+
+    def __init__(self, device_name):
+        self.device_name = device_name
+        self.win = tk.Toplevel()
+        self.win.title(f"Графики — {device_name}")
+        top = tk.Frame(self.win)
+        top.pack(fill="x", padx=10, pady=(10, 0))
+        tk.Label(top, text="Период:").pack(side="left")
+        self.range_box = ttk.Combobox(top, values=[r[0] for r in self.RANGES], width=10, state="readonly")
+        self.range_box.set(self.RANGES[1][0])
+        self.range_box.bind("<<ComboboxSelected>>", lambda e: self.load())
+        self.range_box.pack(side="left", padx=5)
+        self.info = tk.Label(top, text="")
+        self.info.pack(side="right")
+        self.canvas = tk.Canvas(self.win, width=900, height=560, bg="white")
+        self.canvas.pack(fill="both", expand=True, padx=10, pady=10)
+        self.canvas.bind("<Configure>", lambda e: self.draw())
+        self.data = None
+        self.span = None
+        self._loading = None
+        self.load()
+
+    def load(self):
+        days = dict(self.RANGES)[self.range_box.get()]
+        end = datetime.now()
+        start = end - timedelta(days=days) if days else None
+        self.info.config(text="Загрузка...")
+        box = {}
+        self._loading = box
+
+        def work():
+            try:
+                box["data"] = load_trend(self.device_name, start, end)
+            except ImportError:
+                box["error"] = "Для графиков нужен пакет numpy"
+            except Exception as e:
+                box["error"] = f"Ошибка чтения истории: {e}"
+
+        threading.Thread(target=work, daemon=True).start()
+        self._wait(box, start, end)
+
+    def _wait(self, box, start, end):
+        if box is not self._loading:
+            return  # выбран другой период
+        if "data" not in box and "error" not in box:
+            self.win.after(100, self._wait, box, start, end)
+            return
+        if "error" in box:
+            self.info.config(text=box["error"])
+            return
+        self.data = box["data"]
+        t = self.data[0]
+        t0 = trend_seconds(start) if start else (t[0] if len(t) else trend_seconds(end))
+        self.span = (t0, trend_seconds(end))
+        self.info.config(text=f"Точек: {len(t)}")
+        self.draw()
+
+    def draw(self):
+        c = self.canvas
+        c.delete("all")
+        if self.data is None:
+            return
+        import numpy as np
+
+        w, h = c.winfo_width(), c.winfo_height()
+        left, right, top, bottom = 70, 10, 10, 25
+        plot_w = max(w - left - right, 2)
+        panel_h = (h - top - bottom) / len(self.PANELS)
+        t, lo, hi = self.data
+        t0, t1 = self.span
+        cols, ymin, ymax = minmax_downsample(t, lo, hi, t0, t1, plot_w)
+        if not len(cols):
+            c.create_text(w / 2, h / 2, text="Нет данных за период")
+            return
+        xs = left + cols.astype("float64") * plot_w / (plot_w - 1)
+        for i, (title, color) in enumerate(self.PANELS):
+            y0 = top + i * panel_h
+            y1 = y0 + panel_h - 8
+            c.create_rectangle(left, y0, left + plot_w, y1, outline="gray")
+            c.create_text(left + 5, y0 + 2, text=title, anchor="nw")
+            lo_i, hi_i = ymin[:, i], ymax[:, i]
+            ok = ~(np.isnan(lo_i) | np.isnan(hi_i))
+            if not ok.any():
+                continue
+            vmin, vmax = float(lo_i[ok].min()), float(hi_i[ok].max())
+            if vmax == vmin:
+                vmin, vmax = vmin - 1, vmax + 1
+            scale = (y1 - y0 - 20) / (vmax - vmin)
+            y_lo = y1 - 2 - (lo_i[ok] - vmin) * scale
+            y_hi = y1 - 2 - (hi_i[ok] - vmin) * scale
+            # Ломаная проходит через max и min каждого столбца: всплески видны при любом прореживании
+            coords = [0.0] * (4 * int(ok.sum()))
+            coords[0::4] = xs[ok].tolist()
+            coords[1::4] = y_hi.tolist()
+            coords[2::4] = xs[ok].tolist()
+            coords[3::4] = y_lo.tolist()
+            c.create_line(*coords, fill=color)
+            c.create_text(left - 5, y0 + 16, text=format_number(round(vmax, 3)), anchor="ne")
+            c.create_text(left - 5, y1, text=format_number(round(vmin, 3)), anchor="se")
+        fmt = "%Y-%m-%d %H:%M"
+        c.create_text(left, h - 5, text=trend_datetime(t0).strftime(fmt), anchor="sw")
+        c.create_text(left + plot_w, h - 5, text=trend_datetime(t1).strftime(fmt), anchor="se")
+
+
+def show_trend_chart(device_name):
+    TrendChart(device_name)
+
+
 def show_debug_log(device_name):
-    debug_window = tk.Toplevel()
-    debug_window.title(f"Журнал — {device_name}")
-    text = scrolledtext.ScrolledText(debug_window, width=90, height=30, font=("Courier", 9))
-    text.pack(padx=10, pady=10)
+    JournalViewer(device_name)
+
+
+tray_icon = None
+tray_alerts_shown = None
+
 
+def tray_image(alert=False):
+    img = Image.new("RGB", (64, 64), "white")
+    dc = ImageDraw.Draw(img)
+    dc.rectangle([16, 16, 48, 48], outline="black", fill="red" if alert else "blue")
+    return img
+
+
+def tray_title(count):
+    return f"RPSU Monitor — тревог: {count}" if count else "RPSU Monitor"
+
+
+def update_tray_alerts():
+    """Красный значок и всплывающее уведомление, когда число активных тревог выросло."""
+    global tray_alerts_shown
+    icon = tray_icon
+    if icon is None:
+        return
+    count = alert_engine.active_count()
+    if count == tray_alerts_shown:
+        return
     try:
-        with open(f"{device_name}_data.csv", 'r', encoding='utf-8') as f:
-            for line in f:
-                text.insert(tk.END, line)
-    except FileNotFoundError:
-        text.insert(tk.END, "Файл журнала не найден.")
-    text.config(state=tk.DISABLED)
+        icon.icon = tray_image(bool(count))
+        icon.title = tray_title(count)
+        if count > (tray_alerts_shown or 0) and getattr(icon, "HAS_NOTIFICATION", False):
+            icon.notify(tray_title(count), "RPSU Monitor")
+    except Exception as e:
+        print(f"Tray update failed: {e}")
+    tray_alerts_shown = count
 
 
 def create_tray_icon(window_local):
-    def create_image():
-        img = Image.new("RGB", (64, 64), "white")
-        dc = ImageDraw.Draw(img)
-        dc.rectangle([16, 16, 48, 48], outline="black", fill="blue")
-        return img
+    global tray_icon, tray_alerts_shown
 
     def restore(icon, item):
+        global tray_icon
+        tray_icon = None
         icon.stop()
         window_local.deiconify()
 
@@ -278,15 +2751,17 @@ def create_tray_icon(window_local):
         window_local.quit()
         sys.exit()
 
+    count = alert_engine.active_count()
     icon = pystray.Icon(
         "RPSU Monitor",
-        create_image(),
-        "RPSU Monitor",
+        tray_image(bool(count)),
+        tray_title(count),
         pystray.Menu(
             pystray.MenuItem("Открыть", restore),
             pystray.MenuItem("Выход", exit_app)
         )
     )
+    tray_icon, tray_alerts_shown = icon, count
     icon.run()
 
 
@@ -294,25 +2769,33 @@ def add_device(ip_entry, name_entry, status_label):
     global devices
     ip = ip_entry.get().strip()
     name = name_entry.get().strip()
-    if len(devices) >= MAX_DEVICES:
+    if MAX_DEVICES and len(devices) >= MAX_DEVICES:
         status_label.config(text=f"Максимум {MAX_DEVICES} устройств!", fg="red")  # ✅ Исправлено!
         return
     if not ip or not name:
         status_label.config(text="IP и имя обязательны!", fg="red")
         return
-    devices.append({"ip": ip, "name": name, "port": 23})
+    if any(d["name"] == name for d in devices):
+        status_label.config(text=f"Имя {name} уже используется!", fg="red")
+        return
+    device = {"ip": ip, "name": name, "port": 23}
+    devices.append(device)
     save_devices_to_file()
     status_label.config(text=f"Добавлено: {name}", fg="green")
     ip_entry.delete(0, tk.END)
     name_entry.delete(0, tk.END)
-    update_main_window()
+    device_table.add_row(device)
+    sync_poller()
 
 
 def delete_device(name):
     global devices
     devices = [d for d in devices if d["name"] != name]
     save_devices_to_file()
-    update_main_window()
+    alert_engine.forget(name)
+    update_tray_alerts()
+    device_table.remove_row(name)
+    sync_poller()
 
 
 def edit_device(old_name, new_ip, new_name):
@@ -321,9 +2804,14 @@ def edit_device(old_name, new_ip, new_name):
         if d["name"] == old_name:
             d["ip"] = new_ip
             d["name"] = new_name
+            if new_name != old_name:
+                # Тревоги старого имени больше не относятся ни к одной строке
+                alert_engine.forget(old_name)
+                update_tray_alerts()
+            device_table.replace_row(old_name, d)
             break
     save_devices_to_file()
-    update_main_window()
+    sync_poller()
 
 
 def open_edit_window(device):
@@ -340,92 +2828,207 @@ def open_edit_window(device):
 
     def save():
         ip, name = ip_e.get().strip(), name_e.get().strip()
-        if ip and name:
+        if not (ip and name):
+            messagebox.showerror("Ошибка", "Заполните оба поля!")
+        elif name != device["name"] and any(d["name"] == name for d in devices):
+            messagebox.showerror("Ошибка", f"Имя {name} уже используется!")
+        else:
             edit_device(device["name"], ip, name)
             win.destroy()
-        else:
-            messagebox.showerror("Ошибка", "Заполните оба поля!")
     tk.Button(win, text="Сохранить", command=save).grid(row=2, column=0, columnspan=2, pady=10)
 
 
-def update_main_window():
-    global main_frame, devices, window
-    for w in main_frame.winfo_children():
-        w.destroy()
-
-    for i, device in enumerate(devices):
-        frame = tk.Frame(main_frame, relief="groove", bd=2, padx=10, pady=10)
-        frame.grid(row=0, column=i, padx=15, pady=15)
-
-        # Заголовок с иконками
-        hdr = tk.Frame(frame)
-        hdr.grid(row=0, column=0, columnspan=2, sticky="ew")
-        tk.Label(hdr, text=f"{device['name']} — {device['ip']}", font=("Arial", 12, "bold")).pack(side="left")
-        tk.Label(hdr, text="⚙️", cursor="hand2", font=("Arial", 14)).pack(side="right", padx=5)
-        tk.Label(hdr, text="❌", cursor="hand2", font=("Arial", 14)).pack(side="right", padx=5)
-
-        # Привязка иконок
-        for child in hdr.winfo_children():
-            if child.cget("text") == "⚙️":
-                child.bind("<Button-1>", lambda e, d=device: open_edit_window(d))
-            elif child.cget("text") == "❌":
-                child.bind("<Button-1>", lambda e, n=device["name"]: delete_device(n))
-
-        # Переменные
-        status_var = tk.StringVar()
-        uptime_var = tk.StringVar()
-        voltage_var = tk.StringVar()
-        current_var = tk.StringVar()
-        leak_var = tk.StringVar()
-        temp_var = tk.StringVar()
-
-        # Инициализация из CSV
-        s, u, v, c, l, t = get_last_data_from_csv(device["name"])
-        status_var.set("Авария" if s == "OFF" else s or "Нет данных")
-        uptime_var.set(u or "—")
-        voltage_var.set(v or "—")
-        current_var.set(c or "—")
-        leak_var.set(l or "—")
-        temp_var.set(t or "0.0")
-
-        # Поля
-        fields = [
-            ("Статус ДП:", status_var),
-            ("В работе (ч):", uptime_var),
-            ("Напряжение (В):", voltage_var),
-            ("Ток (mA):", current_var),
-            ("Ток утечки (mA):", leak_var),
-            ("Температура (°C):", temp_var),
-        ]
-        temp_label = None
-        for idx, (lbl, var) in enumerate(fields):
-            tk.Label(frame, text=lbl, font=("Arial", 10)).grid(row=idx+1, column=0, sticky="w", pady=2)
-            if lbl == "Температура (°C):":
-                temp_label = tk.Label(frame, textvariable=var, font=("Arial", 10))
-                temp_label.grid(row=idx+1, column=1, sticky="w", pady=2)
+class DeviceTable:
+    """Таблица устройств на ttk.Treeview: одна строка на устройство.
+
+    Добавление, изменение и удаление трогают только свою строку; результаты
+    опроса меняют отдельные ячейки. Поддерживаются сортировка по щелчку на
+    заголовке и фильтр по статусу (скрытые строки отсоединяются через detach).
+    """
+
+    COLUMNS = (
+        ("name", "Устройство", 140),
+        ("ip", "IP", 120),
+        ("status", "Статус ДП", 100),
+        ("uptime", "В работе (ч)", 100),
+        ("voltage", "Напряжение (В)", 110),
+        ("current", "Ток (mA)", 90),
+        ("leak_current", "Ток утечки (mA)", 110),
+        ("temperature", "Температура (°C)", 120),
+        ("alerts", "Тревоги", 160),
+    )
+    ALL = "Все"
+    STATUSES = (ALL, "ON", "Авария", "Нет связи", "Нет RPSU", "Таймаут", "Ошибка", "Нет данных")
+
+    def __init__(self, parent):
+        toolbar = tk.Frame(parent)
+        toolbar.pack(fill="x")
+        tk.Label(toolbar, text="Статус:").pack(side="left")
+        self.filter_box = ttk.Combobox(toolbar, values=self.STATUSES, width=14, state="readonly")
+        self.filter_box.set(self.ALL)
+        self.filter_box.bind("<<ComboboxSelected>>", lambda e: self.apply_filter())
+        self.filter_box.pack(side="left", padx=5)
+        tk.Button(toolbar, text="❌ Удалить", command=self._delete_selected).pack(side="right", padx=5)
+        tk.Button(toolbar, text="⚙️ Изменить", command=self._edit_selected).pack(side="right", padx=5)
+        tk.Button(toolbar, text="График", command=self._chart_selected).pack(side="right", padx=5)
+        tk.Button(toolbar, text="Журнал", command=self._journal_selected).pack(side="right", padx=5)
+
+        body = tk.Frame(parent)
+        body.pack(fill="both", expand=True, pady=(5, 0))
+        self.tree = ttk.Treeview(body, columns=[c[0] for c in self.COLUMNS], show="headings",
+                                 selectmode="browse")
+        for col, title, width in self.COLUMNS:
+            self.tree.heading(col, text=title, command=lambda c=col: self.sort_by(c))
+            self.tree.column(col, width=width, anchor="w")
+        self.tree.tag_configure("hot", foreground="orange")  # 🔶 температура > 40°C
+        scroll = ttk.Scrollbar(body, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scroll.set)
+        self.tree.pack(side="left", fill="both", expand=True)
+        scroll.pack(side="right", fill="y")
+        self.tree.bind("<Double-1>", lambda e: self._journal_selected())
+
+        self._devices = {}      # name -> device
+        self._detached = set()  # строки, скрытые фильтром
+        self._sort = (None, False)
+
+    def load(self, device_list):
+        for device in device_list:
+            self.add_row(device)
+
+    def add_row(self, device):
+        name = device["name"]
+        s, u, v, c, l, t = get_last_data_from_csv(name)
+        values = {
+            "name": name,
+            "ip": device["ip"],
+            "status": "Авария" if s == "OFF" else s or "Нет данных",
+            "uptime": u or "—",
+            "voltage": v or "—",
+            "current": c or "—",
+            "leak_current": l or "—",
+            "temperature": t or "0.0",
+            "alerts": ", ".join(alert_engine.active(name)),
+        }
+        self._devices[name] = device
+        self.tree.insert("", "end", iid=name, values=[values[col] for col, _, _ in self.COLUMNS])
+        gui_updates.forget(name)
+        self._filter_row(name)
+
+    def remove_row(self, name):
+        self._devices.pop(name, None)
+        self._detached.discard(name)
+        gui_updates.forget(name)
+        if self.tree.exists(name):
+            self.tree.delete(name)
+
+    def replace_row(self, old_name, device):
+        if old_name == device["name"]:
+            self._devices[old_name] = device
+            self.tree.set(old_name, "ip", device["ip"])
+            return
+        index = self.tree.index(old_name) if old_name not in self._detached else "end"
+        self.remove_row(old_name)
+        self.add_row(device)
+        if device["name"] not in self._detached:
+            self.tree.move(device["name"], "", index)
+
+    def update_row(self, name, changed):
+        """Обновляет изменившиеся ячейки строки. False — такой строки нет."""
+        if name not in self._devices:
+            return False
+        for field, value in changed.items():
+            if field == "temperature_color":
+                self.tree.item(name, tags=("hot",) if value == "orange" else ())
             else:
-                tk.Label(frame, textvariable=var, font=("Arial", 10)).grid(row=idx+1, column=1, sticky="w", pady=2)
+                self.tree.set(name, field, value)
+        if "status" in changed:
+            self._filter_row(name)
+        return True
+
+    def _matches(self, name):
+        wanted = self.filter_box.get()
+        return wanted == self.ALL or self.tree.set(name, "status") == wanted
+
+    def _filter_row(self, name):
+        if self._matches(name):
+            if name in self._detached:
+                self._detached.discard(name)
+                self.tree.move(name, "", "end")
+        elif name not in self._detached:
+            self._detached.add(name)
+            self.tree.detach(name)
+
+    def apply_filter(self):
+        for name in self._devices:
+            self._filter_row(name)
+        col, reverse = self._sort
+        if col:
+            self._sort_rows(col, reverse)
+
+    @staticmethod
+    def _sort_key(value):
+        try:
+            return (0, float(value), "")
+        except ValueError:
+            return (1, 0.0, value.lower())
+
+    def sort_by(self, col):
+        prev_col, prev_reverse = self._sort
+        reverse = not prev_reverse if prev_col == col else False
+        self._sort = (col, reverse)
+        self._sort_rows(col, reverse)
+
+    def _sort_rows(self, col, reverse):
+        rows = sorted(self.tree.get_children(""), key=lambda n: self._sort_key(self.tree.set(n, col)),
+                      reverse=reverse)
+        for index, name in enumerate(rows):
+            self.tree.move(name, "", index)
+
+    def _selected(self):
+        selection = self.tree.selection()
+        return self._devices.get(selection[0]) if selection else None
+
+    def _journal_selected(self):
+        device = self._selected()
+        if device:
+            show_debug_log(device["name"])
+
+    def _chart_selected(self):
+        device = self._selected()
+        if device:
+            show_trend_chart(device["name"])
+
+    def _edit_selected(self):
+        device = self._selected()
+        if device:
+            open_edit_window(device)
+
+    def _delete_selected(self):
+        device = self._selected()
+        if device and messagebox.askyesno("Удаление", f"Удалить {device['name']}?", parent=self.tree):
+            delete_device(device["name"])
+
+
+def sync_poller():
+    """Передаёт планировщику текущий список устройств (он сам находит разницу)."""
+    poller.set_devices([(d, lambda result, d=d: apply_poll_result(d, result)) for d in devices])
 
-        tk.Button(frame, text="Журнал", command=lambda n=device["name"]: show_debug_log(n)).grid(
-            row=len(fields)+1, column=0, columnspan=2, pady=10
-        )
 
-        if temp_label:
-            threading.Thread(
-                target=device_monitoring,
-                args=(device, status_var, uptime_var, voltage_var, current_var, leak_var, temp_var, temp_label),
-                daemon=True
-            ).start()
+def update_main_window():
+    """Первичное заполнение таблицы устройств."""
+    device_table.load(devices)
+    sync_poller()
 
 
 # --- GUI: основное окно ---
 def create_gui():
-    global main_frame, utc_enabled, devices, window
+    global device_table, utc_enabled, devices, window
+    load_gui_modules()
     window = tk.Tk()
     window.title("RPSU Monitor v0.2")
     window.geometry("1000x500")
 
-    utc_enabled = tk.BooleanVar(value=False)
+    utc_enabled = tk.BooleanVar(value=utc_recording)
 
     tabs = ttk.Notebook(window)
     main_tab = ttk.Frame(tabs)
@@ -439,6 +3042,7 @@ def create_gui():
     # Главная вкладка
     main_frame = tk.Frame(main_tab)
     main_frame.pack(fill="both", expand=True, padx=10, pady=10)
+    device_table = DeviceTable(main_frame)
 
     # Параметры
     tk.Label(cfg_tab, text="IP:").grid(row=0, column=0, sticky="e", padx=5, pady=5)
@@ -460,12 +3064,54 @@ def create_gui():
         global polling_interval
         try:
             polling_interval = int(combo.get())
+            poller.interval_changed()
             messagebox.showinfo("Успех", f"Интервал: {polling_interval} мин")
         except:
             pass
     tk.Button(cfg_tab, text="Применить", command=apply_interval).grid(row=5, column=0, columnspan=2, pady=10)
 
-    tk.Checkbutton(cfg_tab, text="UTC", variable=utc_enabled, font=("Arial", 10)).grid(row=6, column=0, columnspan=2, pady=10)
+    def apply_utc():
+        global utc_recording
+        utc_recording = utc_enabled.get()
+    tk.Checkbutton(cfg_tab, text="UTC", variable=utc_enabled, command=apply_utc,
+                   font=("Arial", 10)).grid(row=6, column=0, columnspan=2, pady=10)
+
+    keep_alive_var = tk.BooleanVar(value=keep_alive_sessions)
+
+    def apply_keep_alive():
+        global keep_alive_sessions
+        keep_alive_sessions = keep_alive_var.get()
+        if not keep_alive_sessions:
+            poller.close_sessions()
+    tk.Checkbutton(cfg_tab, text="Держать соединение", variable=keep_alive_var, command=apply_keep_alive,
+                   font=("Arial", 10)).grid(row=7, column=0, columnspan=2, pady=10)
+
+    adaptive_var = tk.BooleanVar(value=adaptive_polling)
+
+    def apply_adaptive():
+        global adaptive_polling
+        adaptive_polling = adaptive_var.get()
+        poller.interval_changed()  # при --workers флаг уходит процессам опроса
+    tk.Checkbutton(cfg_tab, text="Адаптивный интервал", variable=adaptive_var, command=apply_adaptive,
+                   font=("Arial", 10)).grid(row=8, column=0, columnspan=2, pady=10)
+
+    deadband_var = tk.BooleanVar(value=deadband_recording)
+
+    def apply_deadband():
+        global deadband_recording
+        deadband_recording = deadband_var.get()
+        if not deadband_recording:
+            deadband.clear()
+    tk.Checkbutton(cfg_tab, text="Писать только изменения", variable=deadband_var, command=apply_deadband,
+                   font=("Arial", 10)).grid(row=9, column=0, columnspan=2, pady=10)
+
+    capture_var = tk.BooleanVar(value=capture_transcripts)
+
+    def apply_capture():
+        global capture_transcripts
+        capture_transcripts = capture_var.get()
+    tk.Checkbutton(cfg_tab, text="Сохранять ответы модема", variable=capture_var, command=apply_capture,
+                   font=("Arial", 10)).grid(row=10, column=0, columnspan=2, pady=10)
 
     # Справка
     help_txt = scrolledtext.ScrolledText(help_tab, width=90, height=20, font=("Arial", 9))
@@ -473,12 +3119,23 @@ def create_gui():
     help_txt.insert(tk.END,
 """ИНСТРУКЦИЯ
 ──────────────────────────────────────
-1. Добавьте до 5 устройств (IP + имя).
-2. Редактируйте (⚙️) или удаляйте (❌).
-3. Температура >40°C → оранжевая метка.
+1. Добавьте устройства (IP + имя).
+2. Выберите строку: ⚙️ — изменить, ❌ — удалить,
+   двойной щелчок — журнал. Щелчок по заголовку — сортировка.
+3. Температура >40°C → оранжевая строка.
 4. Данные сохраняются в CSV (по имени).
 5. Закрытие → подтверждение; сворачивание → в трей.
 6. Настройки хранятся в devices.json.
+7. «Адаптивный интервал» — аварийные и перегретые устройства
+   опрашиваются раз в минуту, стабильные — до 4 раз реже.
+8. «Писать только изменения» — повторяющиеся значения не пишутся,
+   раз в час пишется строка-«пульс».
+9. «Сохранять ответы модема» — сырые ответы для повторного разбора
+   (rpsu_reparse.py), если поля записались неверно.
+10. Тревоги (столбец «Тревоги», значок в трее, alerts_log.csv) задаются
+   в alerts.json: пороги, скорость изменения, рост утечки.
+11. Недоступное устройство (3 неудачи подряд) проверяется коротким
+   подключением к порту с растущей паузой, без полного опроса.
 
 Версия: 0.2 (2025)
 by UterGrooll""")
@@ -521,10 +3178,172 @@ by UterGrooll""")
 
     # === конец новой логики ===
 
-    devices = load_devices_from_file()
+    def report_renamed(renamed):
+        messagebox.showwarning("Устройства", "Одинаковые имена устройств переименованы:\n"
+                               + "\n".join(f"{old} → {new}" for old, new in renamed))
+
+    devices = load_devices_from_file(report_renamed)
     update_main_window()
+    gui_updates.start(window, device_table)
     window.mainloop()
 
 
+# --- РЕЖИМ БЕЗ GUI (служба / сервер) ---
+def log_result(device, result):
+    state = result["state"]
+    if state != "ok":
+        print(f"[{device['name']}] {STATE_TEXT[state]}")
+        return
+    rpsu_status, uptime, voltage, current, leak_current, temperature = format_reading(result)
+    print(f"[{device['name']}] Status={rpsu_status} Uptime={uptime} Voltage={voltage} Current={current} "
+          f"Leak={leak_current} Temperature={temperature}")
+
+
+def run_headless(args):
+    """Опрос и запись CSV без Tk: устройства берутся из devices.json, журнал — в stdout."""
+    global devices
+    sys.stdout.reconfigure(line_buffering=True)
+    devices = load_devices_from_file()
+    if not devices:
+        print(f"No devices in {DEVICES_FILE}")
+        return 1
+
+    def on_result(device, result):
+        log_result(device, result)
+        record_result(device, result, utc_recording)
+        check_alerts(device, result)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    print(f"Monitoring {len(devices)} devices every {polling_interval} min")
+    poller.set_devices([(d, lambda r, d=d: on_result(d, r)) for d in devices])
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    print("Stopping")
+    poller.stop()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="RPSU Monitor")
+    parser.add_argument("--headless", action="store_true", help="работа без GUI, журнал в stdout")
+    parser.add_argument("--devices", default=DEVICES_FILE, help="файл со списком устройств")
+    parser.add_argument("--interval", type=float, default=polling_interval, help="интервал опроса, мин")
+    parser.add_argument("--utc", action="store_true", help="дополнительно писать <name>_utc_data.csv")
+    parser.add_argument("--keep-alive", action="store_true", help="держать Telnet-сессии открытыми")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_POLLS,
+                        help="одновременных Telnet-сессий")
+    parser.add_argument("--prompt", action="append", metavar="REGEX",
+                        help="приглашение меню модема (вся последняя строка ответа), можно несколько раз")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="число процессов опроса (устройства делятся между ними)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="чаще опрашивать при аварии/перегреве, реже — при стабильных значениях")
+    parser.add_argument("--deadband", action="store_true",
+                        help="писать в CSV только изменения и строку-«пульс» раз в час")
+    parser.add_argument("--capture", action="store_true",
+                        help="сохранять сырые ответы модема для повторного разбора (rpsu_reparse.py)")
+    parser.add_argument("--probe", action="store_true", help="проверить TCP-порты всех устройств и выйти")
+    parser.add_argument("--probe-timeout", type=float, default=PROBE_TIMEOUT, help="таймаут проверки порта, сек")
+    parser.add_argument("--alerts", default=ALERTS_FILE, help="файл правил тревог (JSON)")
+    parser.add_argument("--history-db", help="дополнительно хранить историю в базе SQLite")
+    parser.add_argument("--metrics-port", type=int, help="локальный HTTP-порт метрик (/metrics, /metrics.json)")
+    parser.add_argument("--metrics-file", help="файл для периодического JSON-снимка метрик")
+    parser.add_argument("--metrics-interval", type=float, default=60, help="период снимка метрик, сек")
+    parser.add_argument("--export", metavar="DEVICE", help="выгрузить историю устройства из --history-db в CSV")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="начало диапазона выгрузки (ГГГГ-ММ-ДД[ ЧЧ:ММ])")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="конец диапазона выгрузки")
+    parser.add_argument("--out", help="файл выгрузки (по умолчанию <DEVICE>_export.csv)")
+    parser.add_argument("--period", choices=ROLLUP_PERIODS,
+                        help="выгрузить агрегаты (<DEVICE>_hourly.csv / _daily.csv) вместо сырых данных")
+    parser.add_argument("--retention-days", type=int,
+                        help="хранить сырые данные N суток, старше — агрегаты и сжатый архив")
+    args = parser.parse_args(argv)
+    for pattern in args.prompt or ():
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            parser.error(f"--prompt {pattern!r}: {e}")
+    return args
+
+
+def run_probe(args):
+    """Разовая параллельная проверка портов всех устройств из devices.json."""
+    device_list = load_devices_from_file()
+    started = time.perf_counter()
+    reachable = asyncio.run(probe_fleet(device_list, args.probe_timeout))
+    for device in device_list:
+        state = "up" if reachable[device["name"]] else "DOWN"
+        print(f"{device['name']:<20} {device['ip']}:{device['port']:<6} {state}")
+    down = sum(1 for up in reachable.values() if not up)
+    print(f"{len(device_list) - down} up, {down} down in {time.perf_counter() - started:.1f} s")
+    return 1 if down else 0
+
+
+def run_export(args):
+    out = args.out or f"{args.export}_export.csv"
+    if args.period:
+        fmt = "%Y-%m-%d %H:%M:%S"
+        rows = read_rollups(args.export, args.period, args.since and args.since.strftime(fmt),
+                            args.until and args.until.strftime(fmt))
+        with open(out, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file, delimiter=";")
+            writer.writerow(ROLLUP_HEADER)
+            writer.writerows(rows)
+        print(f"Exported {len(rows)} {args.period} rows to {out}")
+        return 0
+    if not args.history_db:
+        print("--export requires --history-db (or --period)")
+        return 2
+    count = HistoryStore(args.history_db).export_csv(args.export, out, args.since, args.until)
+    print(f"Exported {count} rows to {out}")
+    return 0
+
+
+def apply_args(args):
+    """Настройки опроса и записи из командной строки — общие для GUI и режима без GUI
+    (флажки и интервал в окне берут начальные значения отсюда)."""
+    global polling_interval, keep_alive_sessions, adaptive_polling, deadband_recording, capture_transcripts
+    global utc_recording
+    polling_interval = int(args.interval) if args.interval == int(args.interval) else args.interval
+    keep_alive_sessions = args.keep_alive
+    adaptive_polling = args.adaptive
+    deadband_recording = args.deadband
+    capture_transcripts = args.capture
+    utc_recording = args.utc
+    poller.concurrency = args.concurrency
+    if args.prompt:
+        set_prompt_patterns(args.prompt)
+
+
+def main(argv=None):
+    global DEVICES_FILE, poller
+    args = parse_args(argv)
+    DEVICES_FILE = args.devices
+    if args.export:
+        return run_export(args)
+    if args.probe:
+        return run_probe(args)
+    alert_engine.rules = load_alert_rules(args.alerts)
+    if args.workers > 1:
+        poller = ShardedPoller(args.workers, args.concurrency)
+    apply_args(args)
+    if args.history_db:
+        csv_writer.history = HistoryStore(args.history_db)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    if args.metrics_file:
+        start_metrics_snapshots(args.metrics_file, args.metrics_interval)
+    if args.retention_days:
+        start_compaction(args.retention_days)
+    if args.headless:
+        return run_headless(args)
+    create_gui()
+    return 0
+
+
 if __name__ == "__main__":
-    create_gui()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""Нагрузочный тест опроса: N симулированных модемов (rpsu_sim.py) и движок RPSU.py.
+
+Симулятор запускается отдельным процессом, чтобы его нагрузка не попадала
+в замеры. Опрос, разбор и запись CSV идут через те же функции, что и в
+программе; CSV пишутся во временный каталог.
+
+    python rpsu_bench.py --devices 200 --concurrency 50 --duration 30 --latency 20 --jitter 10
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import RPSU
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_simulator(args):
+    cmd = [sys.executable, os.path.join(HERE, "rpsu_sim.py"),
+           "--count", str(args.devices), "--base-port", str(args.base_port),
+           "--latency", str(args.latency), "--jitter", str(args.jitter),
+           "--fail-rate", str(args.fail_rate), "--seed", "1"]
+    if args.ansi:
+        cmd.append("--ansi")
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    last_port = args.base_port + args.devices - 1
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", last_port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("simulator did not start")
+
+
+async def run_polls(devices, args):
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(args.concurrency)
+    sessions = RPSU.SessionPool(limit=len(devices)) if args.keep_alive else None
+    latencies = []
+    states = Counter()
+    deadline = loop.time() + args.duration
+
+    async def worker(device):
+        while loop.time() < deadline:
+            async with limit:
+                started = time.perf_counter()
+                result = await RPSU.poll_device_async(device, sessions)
+                RPSU.record_result(device, result, utc=args.utc)
+                latencies.append(time.perf_counter() - started)
+            states[result["state"]] += 1
+
+    await asyncio.gather(*(worker(d) for d in devices))
+    if sessions is not None:
+        sessions.close_all()
+    return latencies, states
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def report(args, latencies, states, wall, cpu, flush_time, threads):
+    latencies.sort()
+    polls = len(latencies)
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"devices={args.devices} concurrency={args.concurrency} keep_alive={args.keep_alive} "
+          f"latency={args.latency}ms jitter={args.jitter}ms fail_rate={args.fail_rate}")
+    print(f"polls:      {polls} in {wall:.1f} s ({polls / wall:.1f} polls/s)")
+    print(f"results:    {', '.join(f'{k}={v}' for k, v in sorted(states.items()))}")
+    if polls:
+        print(f"latency ms: p50={percentile(latencies, 50) * 1000:.1f} p90={percentile(latencies, 90) * 1000:.1f} "
+              f"p99={percentile(latencies, 99) * 1000:.1f} max={latencies[-1] * 1000:.1f} "
+              f"mean={statistics.fmean(latencies) * 1000:.1f}")
+    print(f"cpu:        {cpu:.2f} s ({cpu / wall * 100:.0f}% of one core)")
+    print(f"memory:     max RSS {rss_mb:.1f} MB, threads {threads}")
+    print(f"csv flush:  {flush_time * 1000:.1f} ms at shutdown")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест опроса RPSU")
+    parser.add_argument("--devices", type=int, default=100, help="число симулированных модемов")
+    parser.add_argument("--concurrency", type=int, default=RPSU.MAX_CONCURRENT_POLLS,
+                        help="одновременных Telnet-сессий")
+    parser.add_argument("--duration", type=float, default=20, help="длительность теста, сек")
+    parser.add_argument("--base-port", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=5.0, help="задержка ответа модема, мс")
+    parser.add_argument("--jitter", type=float, default=5.0, help="разброс задержки, мс")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="доля подключений с отказом")
+    parser.add_argument("--ansi", action="store_true", help="ANSI-шум в ответах")
+    parser.add_argument("--keep-alive", action="store_true", help="держать сессии открытыми")
+    parser.add_argument("--utc", action="store_true", help="писать и UTC-файлы")
+    parser.add_argument("--verbose", action="store_true", help="не подавлять вывод RPSU.py")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    devices = [{"ip": "127.0.0.1", "port": args.base_port + i, "name": f"sim{i}"} for i in range(args.devices)]
+    sim = start_simulator(args)
+    workdir = tempfile.mkdtemp(prefix="rpsu_bench_")
+    os.chdir(workdir)
+    quiet = open(os.devnull, "w")
+    try:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else quiet):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            latencies, states = asyncio.run(run_polls(devices, args))
+            threads = threading.active_count()
+            flush_start = time.perf_counter()
+            RPSU.csv_writer.stop()
+            flush_time = time.perf_counter() - flush_start
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    finally:
+        sim.terminate()
+        sim.wait()
+    report(args, latencies, states, wall, cpu, flush_time, threads)
+    print(f"csv files:  {workdir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Повторный разбор сохранённых ответов модема (RPSU.py --capture) и пересборка CSV.
+
+Файлы <name>_raw_<ГГГГ-ММ>.jsonl.gz разбираются текущим парсером RPSU.py
+параллельно на всех ядрах (по файлу на задачу). Заменяются только строки
+CSV с отметкой времени сохранённого опроса; остальные строки (в том числе
+за время, когда сохранение ответов было выключено) остаются как есть.
+Если старые строки уже перенесены в архив (--retention-days), опросы
+раньше первой строки журнала пропускаются: архив и агрегаты за этот
+период не пересобираются, а повторная вставка задвоила бы их.
+
+    python rpsu_reparse.py --dir C:\\RPSU --out-dir reparsed
+    python rpsu_reparse.py --device name1 --in-place --utc
+
+Запускайте при остановленном мониторе: при --in-place файлы CSV заменяются
+(прежние остаются рядом с расширением .bak). Агрегаты (--retention-days)
+и база --history-db не пересчитываются.
+"""
+import argparse
+import csv
+import glob
+import heapq
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import RPSU
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def find_transcripts(directory, names=None):
+    """{device_name: [файлы по месяцам по порядку]}."""
+    found = defaultdict(list)
+    for path in glob.glob(os.path.join(directory, "*_raw_*.jsonl.gz")):
+        name = os.path.basename(path).rsplit("_raw_", 1)[0]
+        if not names or name in names:
+            found[name].append(path)
+    return {name: sorted(paths) for name, paths in sorted(found.items())}
+
+
+def parse_file(path):
+    """Задача для процесса пула: [(время, результат)] успешных опросов, время всех
+    сохранённых опросов и счётчики состояний."""
+    name = os.path.basename(path).rsplit("_raw_", 1)[0]
+    readings = []
+    captured = []
+    states = Counter()
+    missing = Counter()
+    for record in RPSU.read_transcript(path):
+        result = RPSU.parse_transcript(record, name)
+        captured.append(datetime.strptime(record["ts"], TS_FORMAT))
+        states[result["state"]] += 1
+        if result["state"] != "ok":
+            continue
+        missing.update(result["missing"])
+        del result["missing"]
+        readings.append((captured[-1], result))
+    return readings, captured, states, missing
+
+
+def build_rows(readings, row, deadband):
+    if deadband:
+        recorder = RPSU.DeadbandRecorder()
+        readings = [kept for timestamp, result in readings for kept in recorder.filter("", result, timestamp)]
+    return [row(timestamp, *RPSU.format_reading(result)) for timestamp, result in readings]
+
+
+def old_rows(source, replaced, kept):
+    """Строки source, кроме строк с отметкой времени из replaced; kept[0] — счётчик оставленных."""
+    if not os.path.exists(source):
+        return
+    with open(source, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=";")
+        next(reader, None)
+        for old in reader:
+            if old and old[0] not in replaced:
+                kept[0] += 1
+                yield old
+
+
+def merge_csv(source, target, rows, replaced):
+    """Пишет target: строки source и rows вперемешку по времени; строки source
+    с отметкой времени из replaced заменяются. Возвращает число оставленных строк."""
+    kept = [0]
+    tmp = target + ".tmp"
+    with open(tmp, mode="w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(RPSU.CSV_HEADER)
+        writer.writerows(heapq.merge(old_rows(source, replaced, kept), rows, key=lambda row: row[0]))
+    if source == target and os.path.exists(source):
+        os.replace(source, source + ".bak")
+    os.replace(tmp, target)
+    return kept[0]
+
+
+def archived_before(source):
+    """Отметка времени первой строки журнала, если более ранние строки уже в архиве; иначе None.
+
+    Журнал пуст, а архив есть — в архиве всё, граница "9999" больше любой отметки.
+    """
+    if not os.path.exists(source[:-len(".csv")] + ".archive.csv.gz"):
+        return None
+    first = RPSU.read_first_csv_row(source) if os.path.exists(source) else None
+    return first[0] if first else "9999"
+
+
+def regenerate(name, readings, captured, args):
+    outputs = [(f"{name}_data.csv", RPSU.csv_row, timedelta(0))]
+    if args.utc:
+        outputs.append((f"{name}_utc_data.csv", RPSU.utc_csv_row, timedelta(hours=3)))
+    for filename, row, shift in outputs:
+        source = os.path.join(args.dir, filename)
+        target = source if args.in_place else os.path.join(args.out_dir, filename)
+        rows = build_rows(readings, row, args.deadband)
+        replaced = {(timestamp - shift).strftime(TS_FORMAT) for timestamp in captured}
+        boundary = archived_before(source)
+        skipped = 0
+        if boundary:
+            skipped = sum(1 for new in rows if new[0] < boundary)
+            rows = [new for new in rows if new[0] >= boundary]
+            replaced = {ts for ts in replaced if ts >= boundary}
+        kept = merge_csv(source, target, rows, replaced)
+        print(f"  {target}: {len(rows)} reparsed rows, {kept} kept from the old file"
+              + (f", {skipped} older rows skipped (already archived)" if skipped else ""))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Повторный разбор сохранённых ответов RPSU и пересборка CSV")
+    parser.add_argument("--dir", default=".", help="каталог с *_raw_*.jsonl.gz и CSV")
+    parser.add_argument("--device", action="append", help="только это устройство (можно несколько раз)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="число процессов разбора")
+    parser.add_argument("--out-dir", default="reparsed", help="куда писать новые CSV")
+    parser.add_argument("--in-place", action="store_true", help="заменить CSV в --dir (прежние → .bak)")
+    parser.add_argument("--utc", action="store_true", help="пересобрать и <name>_utc_data.csv")
+    parser.add_argument("--deadband", action="store_true", help="писать только изменения, как RPSU.py --deadband")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    found = find_transcripts(args.dir, args.device)
+    if not found:
+        print(f"No transcripts in {args.dir}")
+        return 1
+    if not args.in_place:
+        os.makedirs(args.out_dir, exist_ok=True)
+    paths = [path for files in found.values() for path in files]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        parsed = dict(zip(paths, pool.map(parse_file, paths)))
+    print(f"Parsed {len(paths)} files in {time.perf_counter() - started:.1f} s ({args.jobs} processes)")
+    for name, files in found.items():
+        readings, captured, states, missing = [], [], Counter(), Counter()
+        for path in files:
+            file_readings, file_captured, file_states, file_missing = parsed[path]
+            readings.extend(file_readings)
+            captured.extend(file_captured)
+            states.update(file_states)
+            missing.update(file_missing)
+        print(f"{name}: {', '.join(f'{k}={v}' for k, v in sorted(states.items()))}"
+              + (f"; missing {', '.join(f'{k}={v}' for k, v in sorted(missing.items()))}" if missing else ""))
+        if captured:
+            regenerate(name, readings, captured, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Симулятор модемов MGS-4 с платой RPSU для проверки опроса без оборудования.
+
+Каждое устройство слушает свой TCP-порт (base_port + i) и отвечает на
+команды меню так же, как модем: "2", STATUS, "%1", ECHO, "%104", "1", SHOW.
+Задержка ответа, разброс, ANSI-шум и отказы настраиваются ключами.
+
+    python rpsu_sim.py --count 100 --base-port 20000 --latency 20 --jitter 10
+"""
+import argparse
+import asyncio
+import random
+import sys
+
+IAC, DO, WILL = 255, 253, 251
+OPT_ECHO, OPT_SGA = 1, 3
+
+FAILURES = ("refuse", "drop", "hang", "no_board", "off")
+
+
+class FakeModem:
+    """Один модем: состояние меню на каждое подключение, значения RPSU медленно меняются."""
+
+    def __init__(self, index, latency=0.0, jitter=0.0, ansi=False, fail_rate=0.0, failures=FAILURES,
+                 seed=None):
+        self.index = index
+        self.latency = latency
+        self.jitter = jitter
+        self.ansi = ansi
+        self.fail_rate = fail_rate
+        self.failures = failures
+        self.rng = random.Random(seed if seed is None else seed + index)
+        self.uptime = self.rng.randint(1, 5000)
+        self.voltage = self.rng.uniform(170.0, 190.0)
+        self.current = self.rng.uniform(30.0, 60.0)
+        self.temperature = self.rng.uniform(25.0, 45.0)
+
+    def _noise(self, text):
+        if not self.ansi:
+            return text
+        return f"\x1b[1;3{self.rng.randint(1, 7)}m{text}\x1b[0m\x07"
+
+    def status_text(self):
+        self.temperature += self.rng.uniform(-0.2, 0.2)
+        return (f"Modem MGS-4 #{self.index}\r\n"
+                f"{self._noise('Temperature')} : {self.temperature:.3f} C\r\n")
+
+    def show_text(self, rpsu_on=True):
+        self.uptime += 1
+        self.voltage += self.rng.uniform(-0.5, 0.5)
+        self.current += self.rng.uniform(-0.3, 0.3)
+        status = "ON" if rpsu_on else "OFF"
+        return (f"RPSU Status: {self._noise(status)}\r\n"
+                f"RPSU Uptime: {self.uptime}\r\n"
+                f"Voltage : {self.voltage:.2f}\r\n"
+                f"Current : {self.current:.2f}\r\n"
+                f"Leak Current : {self.rng.uniform(0.0, 0.05):.3f}\r\n")
+
+    async def _reply(self, writer, text, prompt):
+        delay = self.latency + self.rng.uniform(0.0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        writer.write((text + prompt).encode("ascii"))
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        failure = self.rng.choice(self.failures) if self.rng.random() < self.fail_rate else None
+        try:
+            if failure == "refuse":
+                return
+            # Модем предлагает опции Telnet — клиент должен от них отказаться
+            writer.write(bytes((IAC, WILL, OPT_ECHO, IAC, WILL, OPT_SGA, IAC, DO, OPT_SGA)))
+            await self._reply(writer, "MGS-4 Telnet\r\n", "MGS4> ")
+            prompt = "MGS4> "
+            fail_at = self.rng.randint(1, 7)
+            step = 0
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                command = line.strip().decode("ascii", errors="ignore").upper()
+                step += 1
+                if failure == "drop" and step == fail_at:
+                    return
+                if failure == "hang" and step == fail_at:
+                    await reader.read()  # молчим до разрыва со стороны клиента
+                    return
+                if command == "STATUS":
+                    text = self.status_text()
+                elif command == "ECHO":
+                    text = "Boards: 01 02\r\n" if failure == "no_board" else "Boards: 01 02 04\r\n"
+                elif command == "%104":
+                    prompt = "RPSU04> "
+                    text = ""
+                elif command == "SHOW":
+                    text = self.show_text(rpsu_on=failure != "off")
+                else:
+                    text = ""
+                await self._reply(writer, command + "\r\n" + text, prompt)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(count, base_port, host="127.0.0.1", **options):
+    servers = []
+    for i in range(count):
+        modem = FakeModem(i, **options)
+        servers.append(await asyncio.start_server(modem.handle, host, base_port + i))
+    print(f"Simulating {count} modems on {host}:{base_port}-{base_port + count - 1}", flush=True)
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Симулятор модемов MGS-4 / RPSU")
+    parser.add_argument("--count", type=int, default=1, help="число модемов")
+    parser.add_argument("--base-port", type=int, default=20000, help="порт первого модема")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа на команду, мс")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--ansi", action="store_true", help="добавлять ANSI-последовательности в ответы")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="доля подключений с отказом (0..1)")
+    parser.add_argument("--failures", default=",".join(FAILURES),
+                        help=f"виды отказов через запятую: {', '.join(FAILURES)}")
+    parser.add_argument("--seed", type=int, help="зерно генератора для воспроизводимости")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    failures = tuple(f.strip() for f in args.failures.split(",") if f.strip())
+    unknown = set(failures) - set(FAILURES)
+    if unknown:
+        print(f"Unknown failure modes: {', '.join(sorted(unknown))}")
+        return 2
+    try:
+        asyncio.run(serve(args.count, args.base_port, args.host,
+                          latency=args.latency / 1000, jitter=args.jitter / 1000, ansi=args.ansi,
+                          fail_rate=args.fail_rate, failures=failures, seed=args.seed))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
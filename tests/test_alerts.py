@@ -0,0 +1,82 @@
+"""Правила тревог: гистерезис, защита от дребезга, средняя drift и проверка alerts.json."""
+import json
+
+import pytest
+
+import RPSU
+
+
+def run(engine, values, field="temperature", name="dev", start=0.0, step=60.0):
+    """Прогоняет значения поля через движок; возвращает события по порядку."""
+    events = []
+    for i, value in enumerate(values):
+        events += engine.evaluate(name, {"state": "ok", field: value}, start + i * step)
+    return [(event["event"], event["value"]) for event in events]
+
+
+def test_threshold_debounce_and_hysteresis():
+    rule = RPSU.AlertRule({"name": "hot", "field": "temperature", "above": 40, "clear": 38,
+                           "debounce": 2, "clear_debounce": 2})
+    engine = RPSU.AlertEngine([rule])
+    # Одиночный выброс не поднимает тревогу, два подряд — поднимают
+    assert run(engine, [41, 30, 41, 42]) == [("raise", 42)]
+    assert engine.active("dev") == ["hot"]
+    # Между clear и limit тревога держится; снимается после двух значений ниже clear
+    assert run(engine, [39, 37, 39, 37, 36], start=1000) == [("clear", 36)]
+    assert engine.active("dev") == []
+    assert engine.active_count() == 0
+
+
+def test_threshold_below():
+    rule = RPSU.AlertRule({"name": "low", "field": "voltage", "below": 200, "clear": 210})
+    engine = RPSU.AlertEngine([rule])
+    assert run(engine, [220, 199, 205, 211], field="voltage") == [("raise", 199), ("clear", 211)]
+
+
+def test_drift_baseline_frozen_while_active():
+    rule = RPSU.AlertRule({"name": "leak", "kind": "drift", "field": "leak_current",
+                           "limit": 0.3, "clear": 0.15, "alpha": 0.5})
+    engine = RPSU.AlertEngine([rule])
+    assert run(engine, [1.0, 1.0, 1.5], field="leak_current") == [("raise", 1.5)]
+    # Пока тревога активна, средняя не подтягивается к росту, и тревога не «растворяется»
+    assert run(engine, [1.5, 1.5, 1.5], field="leak_current", start=1000) == []
+    assert engine._state[("dev", "leak")]["baseline"] == 1.0
+    assert run(engine, [1.1], field="leak_current", start=2000) == [("clear", 1.1)]
+    assert engine._state[("dev", "leak")]["baseline"] == pytest.approx(1.05)
+
+
+def test_forget_drops_state():
+    engine = RPSU.AlertEngine([RPSU.AlertRule({"name": "hot", "field": "temperature", "above": 40})])
+    run(engine, [45])
+    engine.forget("dev")
+    assert engine.active("dev") == []
+    assert run(engine, [45], start=1000) == [("raise", 45)]
+
+
+@pytest.mark.parametrize("spec", [
+    {"name": "bad", "kind": "threshold", "field": "status", "above": 1},
+    {"name": "bad", "kind": "rate", "field": "state", "limit": 1},
+    {"name": "bad", "kind": "drift", "field": "status", "limit": 1},
+    {"name": "bad", "kind": "spike", "field": "voltage", "limit": 1},
+])
+def test_bad_rule_rejected(spec):
+    with pytest.raises(ValueError):
+        RPSU.AlertRule(spec)
+
+
+def test_bad_rules_file_falls_back_to_defaults(tmp_path):
+    path = tmp_path / "alerts.json"
+    path.write_text(json.dumps([{"name": "bad", "kind": "threshold", "field": "status", "above": 1}]),
+                    encoding="utf-8")
+    rules = RPSU.load_alert_rules(str(path))
+    assert [rule.name for rule in rules] == [spec["name"] for spec in RPSU.DEFAULT_ALERT_RULES]
+
+
+def test_failing_rule_does_not_stop_others():
+    engine = RPSU.AlertEngine([
+        RPSU.AlertRule({"name": "jump", "kind": "rate", "field": "voltage", "limit": 10}),
+        RPSU.AlertRule({"name": "off", "kind": "equals", "field": "status", "value": "OFF"}),
+    ])
+    events = engine.evaluate("dev", {"state": "ok", "voltage": "n/a", "status": "OFF"}, 0.0)
+    events += engine.evaluate("dev", {"state": "ok", "voltage": "n/a", "status": "OFF"}, 60.0)
+    assert [(event["rule"], event["event"]) for event in events] == [("off", "raise")]